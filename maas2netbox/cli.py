@@ -14,49 +14,199 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import importlib
 import logging
+import os
+import sys
+from collections import OrderedDict
 
-from maas2netbox import validators, updaters, creators
 
+class LazyModule(object):
+    """Module imported on first attribute access, keeping startup light"""
 
-def run_validation(args):
-    validator = None
-    if args.field == 'serialnumber':
-        validator = validators.SerialNumberValidator(use_maas=True)
-    elif args.field == 'status':
-        validator = validators.StatusValidator(use_maas=True)
-    elif args.field == 'primaryIPv4':
-        validator = validators.PrimaryIPv4Validator(use_maas=True)
-    elif args.field == 'interfaces':
-        validator = validators.InterfacesValidator(use_maas=True)
-    elif args.field == 'platform':
-        validator = validators.PlatformValidator(use_maas=True)
-    elif args.field == 'switch_connections':
-        validator = validators.SwitchConnectionsValidator(use_maas=True)
-    elif args.field == 'experimental':
-        validator = validators.ExperimentalValidator(use_maas=True)
+    def __init__(self, name):
+        self.name = name
 
-    return validator.check_nodes()
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.name), attr)
+
+
+validators = LazyModule('maas2netbox.validators')
+updaters = LazyModule('maas2netbox.updaters')
+creators = LazyModule('maas2netbox.creators')
+snapshot = LazyModule('maas2netbox.snapshot')
+plan = LazyModule('maas2netbox.plan')
+netbox = LazyModule('maas2netbox.utils.netbox')
+sync = LazyModule('maas2netbox.sync')
+store = LazyModule('maas2netbox.store')
+daemon = LazyModule('maas2netbox.daemon')
+
+VALIDATORS = {
+    'serialnumber': 'SerialNumberValidator',
+    'status': 'StatusValidator',
+    'primaryIPv4': 'PrimaryIPv4Validator',
+    'interfaces': 'InterfacesValidator',
+    'platform': 'PlatformValidator',
+    'switch_connections': 'SwitchConnectionsValidator',
+    'experimental': 'ExperimentalValidator',
+}
+
+UPDATERS = {
+    'serialnumber': 'SerialNumberUpdater',
+    'status': 'StatusUpdater',
+    'primaryIPv4': 'PrimaryIPv4Updater',
+    'interfaces': 'InterfacesUpdater',
+    'platform': 'PlatformUpdater',
+    'experimental': 'ExperimentalUpdater',
+}
+
+# Fields checked by `-f all`, in the order they are reported
+ALL_FIELDS = ['serialnumber', 'status', 'primaryIPv4', 'interfaces',
+              'platform', 'switch_connections']
+
+
+def get_validator(field, snapshot=None):
+    validator_class = getattr(validators, VALIDATORS[field])
+    return validator_class(use_maas=True, snapshot=snapshot)
+
+
+def get_updater(field, nodes_with_errors):
+    updater_class = getattr(updaters, UPDATERS[field])
+    return updater_class(nodes_with_errors)
+
+
+def get_tracker(args):
+    """Change tracker of incremental runs, saved by update only"""
+    if not args.incremental:
+        return None
+    return sync.ChangeTracker(args.field)
+
+
+def check_store(parser, args):
+    """Fail early on a missing store file or snapshot"""
+    if not os.path.exists(args.store):
+        parser.error('store {} does not exist'.format(args.store))
+    snapshot_store = store.SnapshotStore(args.store)
+    try:
+        if args.snapshot_id is None:
+            snapshot_store.latest_id()
+        elif not snapshot_store.has_snapshot(args.snapshot_id):
+            parser.error('snapshot {} is not in store {}'.format(
+                args.snapshot_id, args.store))
+    except LookupError:
+        parser.error('no snapshot is recorded in store {}'.format(
+            args.store))
+    finally:
+        snapshot_store.close()
+
+
+def run_all_validations(args, tracker=None, snapshot_store=None):
+    if snapshot_store:
+        shared_snapshot = store.StoredSnapshot(
+            snapshot_store, args.snapshot_id)
+    else:
+        shared_snapshot = snapshot.Snapshot(tracker=tracker)
+    # Built here, since building validators talks to MaaS
+    field_validators = [
+        (field, get_validator(field, shared_snapshot))
+        for field in ALL_FIELDS]
+
+    if args.workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        # Read devices before the workers start, or each would stream them
+        shared_snapshot.netbox_nodes
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                (field, executor.submit(validator.check_nodes))
+                for field, validator in field_validators]
+            return OrderedDict(
+                (field, future.result()) for field, future in futures)
+
+    return OrderedDict(
+        (field, validator.check_nodes())
+        for field, validator in field_validators)
+
+
+def run_validation(args, tracker=None):
+    snapshot_store = store.SnapshotStore(args.store) if args.store else None
+    try:
+        if args.field == 'all':
+            results = run_all_validations(args, tracker, snapshot_store)
+        elif snapshot_store:
+            results = get_validator(args.field, store.StoredSnapshot(
+                snapshot_store, args.snapshot_id)).check_nodes()
+        elif tracker:
+            results = get_validator(
+                args.field, snapshot.Snapshot(retain=False, tracker=tracker)
+            ).check_nodes()
+        else:
+            results = get_validator(args.field).check_nodes()
+    finally:
+        if snapshot_store:
+            snapshot_store.close()
+
+    if args.plan:
+        plan.write_plan(
+            args.plan,
+            results if args.field == 'all' else {args.field: results})
+
+    return results
+
+
+def read_plan(args):
+    """Changes saved by a previous validate, without stale entries"""
+    changes = plan.drop_stale_changes(
+        plan.read_plan(args.plan), netbox.get_netbox_api())
+    if args.field == 'all':
+        return changes
+
+    return changes.get(args.field, {})
 
 
 def run_updates(args):
-    nodes_with_errors = run_validation(args)
+    tracker = None
+    if args.plan:
+        nodes_with_errors = read_plan(args)
+    else:
+        tracker = get_tracker(args)
+        nodes_with_errors = run_validation(args, tracker)
+
+    if args.field == 'all':
+        results = {}
+        for field in ALL_FIELDS:
+            if field in UPDATERS and field in nodes_with_errors:
+                results[field] = get_updater(
+                    field, nodes_with_errors[field]).update_nodes()
+    else:
+        results = get_updater(args.field, nodes_with_errors).update_nodes()
+
+    if tracker:
+        tracker.save()
+    return results
+
 
-    updater = None
-    if args.field == 'serialnumber':
-        updater = updaters.SerialNumberUpdater(nodes_with_errors)
-    elif args.field == 'status':
-        updater = updaters.StatusUpdater(nodes_with_errors)
-    elif args.field == 'primaryIPv4':
-        updater = updaters.PrimaryIPv4Updater(nodes_with_errors)
-    elif args.field == 'interfaces':
-        updater = updaters.InterfacesUpdater(nodes_with_errors)
-    elif args.field == 'platform':
-        updater = updaters.PlatformUpdater(nodes_with_errors)
-    elif args.field == 'experimental':
-        updater = updaters.ExperimentalUpdater(nodes_with_errors)
+def run_snapshot(args):
+    snapshot_store = store.SnapshotStore(args.store)
+    try:
+        return snapshot_store.record(snapshot.Snapshot())
+    finally:
+        snapshot_store.close()
 
-    return updater.update_nodes()
+
+def run_server(args):
+    from maas2netbox import config
+    fields = ALL_FIELDS if args.field == 'all' else [args.field]
+    reconciler = daemon.Reconciler(get_validator, fields)
+    host, _, port = args.listen.rpartition(':')
+    server = daemon.start_server(
+        reconciler, list(VALIDATORS) + ['all'], host or '127.0.0.1',
+        int(port), config.serve_token)
+    try:
+        reconciler.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
 
 
 def run_creators(args):
@@ -65,7 +215,7 @@ def run_creators(args):
     else:
         raise NotImplementedError
 
-    return creator.create()
+    return creator.create(workers=args.workers)
 
 
 def main():
@@ -78,28 +228,72 @@ def main():
     required_args = parser.add_argument_group('required arguments')
     required_args.add_argument(
         '-c', dest='command', help='Choose command',
-        choices=['validate', 'update', 'create'], required=True)
+        choices=['validate', 'update', 'create', 'snapshot', 'serve'],
+        required=True)
     required_args.add_argument(
         '-f', dest='field', help='Choose field',
         choices=['serialnumber', 'status', 'primaryIPv4', 'interfaces',
-                 'platform', 'switch_connections', 'experimental'],
+                 'platform', 'switch_connections', 'experimental', 'all'],
         required=True)
     parser.add_argument(
         '--log', dest='loglevel',
         choices=['CRITICAL', 'FATAL', 'ERROR', 'WARN', 'WARNING', 'INFO',
                  'DEBUG', 'NOTSET'], default='INFO')
+    parser.add_argument(
+        '--workers', dest='workers', type=int, default=1,
+        help=('Number of validators to run in parallel with -f all, or of '
+              'nodes updated in parallel by create'))
+    parser.add_argument(
+        '--incremental', dest='incremental', action='store_true',
+        help=('Only check MaaS nodes changed since the previous incremental '
+              'update, with a periodic full sweep'))
+    parser.add_argument(
+        '--plan', dest='plan',
+        help=('Plan file written by validate, or applied by update '
+              'instead of validating again'))
+    parser.add_argument(
+        '--store', dest='store',
+        help=('SQLite file the snapshot command records MaaS and NetBox '
+              'into, and validate reads from instead of the live APIs'))
+    parser.add_argument(
+        '--snapshot-id', dest='snapshot_id', type=int,
+        help='Stored snapshot to validate (default: the latest)')
+    parser.add_argument(
+        '--listen', dest='listen', default='127.0.0.1:8080',
+        help='Address the serve command listens on (default: %(default)s)')
+    parser.add_argument(
+        '--interval', dest='interval', type=int, default=3600,
+        help=('Seconds between scheduled validations of the serve command, '
+              '0 to validate on request only (default: %(default)s)'))
     parser.add_argument(
         '--data', dest='data', help='JSON data in string format',
         required=False)
     args = parser.parse_args()
+    if args.command == 'snapshot' and not args.store:
+        parser.error('the snapshot command requires --store')
+    if args.store and args.command not in ('validate', 'snapshot'):
+        parser.error('--store only applies to validate and snapshot')
+    if args.store and args.incremental:
+        parser.error('--incremental cannot be used with --store')
+    if args.incremental and args.command not in ('validate', 'update'):
+        parser.error('--incremental only applies to validate and update')
+    if args.incremental and args.plan and args.command == 'update':
+        parser.error('--incremental cannot be used to apply a --plan')
+    if args.store and args.command == 'validate':
+        check_store(parser, args)
     logging.basicConfig(level=args.loglevel)
 
     if args.command == 'validate':
-        run_validation(args)
+        run_validation(args, get_tracker(args))
     elif args.command == 'update':
         run_updates(args)
     elif args.command == 'create':
-        run_creators(args)
+        if run_creators(args):
+            sys.exit(1)
+    elif args.command == 'snapshot':
+        run_snapshot(args)
+    elif args.command == 'serve':
+        run_server(args)
 
 
 if __name__ == '__main__':
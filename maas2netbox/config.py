@@ -15,8 +15,6 @@
 
 import os
 
-from maas.client import enum
-
 
 maas_url = os.environ.get('MAAS_URL')
 maas_api_key = os.environ.get('MAAS_API_KEY')
@@ -27,32 +25,48 @@ try:
 except AttributeError:
     netbox_device_ids = []
 site_name = os.environ.get('SITE')
+maas_concurrency = int(os.environ.get('MAAS_CONCURRENCY', 16))
+cache_dir = os.environ.get('MAAS2NETBOX_CACHE_DIR')
+netbox_cache_ttl = int(os.environ.get('NETBOX_CACHE_TTL', 3600))
+maas_cache_size = int(os.environ.get('MAAS_CACHE_SIZE', 10000))
+netbox_bulk_size = int(os.environ.get('NETBOX_BULK_SIZE', 100))
+netbox_pool_size = int(os.environ.get('NETBOX_POOL_SIZE', 10))
+netbox_timeout = int(os.environ.get('NETBOX_TIMEOUT', 60))
+netbox_page_size = int(os.environ.get('NETBOX_PAGE_SIZE', 1000))
+netbox_page_workers = int(os.environ.get('NETBOX_PAGE_WORKERS', 4))
+maas_sweep_interval = int(os.environ.get('MAAS_SWEEP_INTERVAL', 86400))
+netbox_mirror = os.environ.get('NETBOX_MIRROR', '').lower() in (
+    '1', 'true', 'yes')
+netbox_sweep_interval = int(os.environ.get('NETBOX_SWEEP_INTERVAL', 86400))
+serve_token = os.environ.get('MAAS2NETBOX_SERVE_TOKEN')
 
+# Keyed by the names of MaaS node statuses, so that loading the configuration
+# does not need to import python-libmaas
 STATUS_DICT = {
-    enum.NodeStatus.DEPLOYED: 'Active',
-    enum.NodeStatus.ALLOCATED: 'Planned',
-    enum.NodeStatus.NEW: 'Inventory',
-    enum.NodeStatus.DEFAULT: 'Inventory',
-    enum.NodeStatus.READY: 'Offline',
-    enum.NodeStatus.BROKEN: 'Failed',
-    enum.NodeStatus.FAILED_COMMISSIONING: 'Failed',
-    enum.NodeStatus.FAILED_DEPLOYMENT: 'Failed',
-    enum.NodeStatus.RESCUE_MODE: 'Failed',
-    enum.NodeStatus.FAILED_TESTING: 'Failed',
-    enum.NodeStatus.FAILED_EXITING_RESCUE_MODE: 'Failed',
-    enum.NodeStatus.FAILED_ENTERING_RESCUE_MODE: 'Failed',
-    enum.NodeStatus.FAILED_DISK_ERASING: 'Failed',
-    enum.NodeStatus.FAILED_RELEASING: 'Failed',
-    enum.NodeStatus.COMMISSIONING: None,
-    enum.NodeStatus.DEPLOYING: None,
-    enum.NodeStatus.ENTERING_RESCUE_MODE: None,
-    enum.NodeStatus.EXITING_RESCUE_MODE: None,
-    enum.NodeStatus.TESTING: None,
-    enum.NodeStatus.RELEASING: None,
-    enum.NodeStatus.DISK_ERASING: None,
-    enum.NodeStatus.MISSING: 'Failed',
-    enum.NodeStatus.RESERVED: 'Planned',
-    enum.NodeStatus.RETIRED: 'Offline'
+    'DEPLOYED': 'Active',
+    'ALLOCATED': 'Planned',
+    'NEW': 'Inventory',
+    'DEFAULT': 'Inventory',
+    'READY': 'Offline',
+    'BROKEN': 'Failed',
+    'FAILED_COMMISSIONING': 'Failed',
+    'FAILED_DEPLOYMENT': 'Failed',
+    'RESCUE_MODE': 'Failed',
+    'FAILED_TESTING': 'Failed',
+    'FAILED_EXITING_RESCUE_MODE': 'Failed',
+    'FAILED_ENTERING_RESCUE_MODE': 'Failed',
+    'FAILED_DISK_ERASING': 'Failed',
+    'FAILED_RELEASING': 'Failed',
+    'COMMISSIONING': None,
+    'DEPLOYING': None,
+    'ENTERING_RESCUE_MODE': None,
+    'EXITING_RESCUE_MODE': None,
+    'TESTING': None,
+    'RELEASING': None,
+    'DISK_ERASING': None,
+    'MISSING': 'Failed',
+    'RESERVED': 'Planned',
+    'RETIRED': 'Offline'
 }
 
 CABLE_COLORS = {
@@ -15,56 +15,87 @@
 
 import json
 import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from maas.client import enum
 
-from maas2netbox.utils import maas, netbox
+from maas2netbox.snapshot import Snapshot
+from maas2netbox.utils import maas
+
+
+# Fields of a MaaS interface written to NetBox, read before workers start
+NodeInterface = namedtuple('NodeInterface', [
+    'name', 'type', 'enabled', 'mac_address', 'mtu', 'vid', 'parents',
+    'ipv4'])
 
 
 class Creator(object):
-    def __init__(self, data):
-        self.netbox_api = netbox.NetBoxAPI()
+    def __init__(self, data, snapshot=None):
+        self.snapshot = snapshot or Snapshot()
+        self.netbox_api = self.snapshot.netbox_api
         if data:
             self.data = json.loads(data)
+        self._netbox_nodes = None
+        self._maas_nodes = None
+
+    def refresh(self):
+        """Fetch both inventories again on next access"""
+        self.snapshot.refresh()
+        self._netbox_nodes = None
+        self._maas_nodes = None
 
     @property
     def netbox_nodes(self):
-        nodes = self.netbox_api.get_nodes()
-        node_dict = {}
-        for node in nodes:
-            node_dict[node.name.lower()] = node.id
-        return node_dict
+        if self._netbox_nodes is None:
+            node_dict = {}
+            for node in self.snapshot.netbox_nodes:
+                node_dict[node.name.lower()] = node.id
+            self._netbox_nodes = node_dict
+        return self._netbox_nodes
 
     @property
     def maas_nodes(self):
-        nodes = []
-        maas_nodes = maas.get_nodes()
-        for node in maas_nodes:
-            if (
-                node.status in [
-                    enum.NodeStatus.DEPLOYED, enum.NodeStatus.READY]
-            ):
-                nodes.append(node)
-        return nodes
-
-    def create(self):
+        if self._maas_nodes is None:
+            nodes = []
+            for node in maas.get_nodes():
+                if (
+                    node.status in [
+                        enum.NodeStatus.DEPLOYED, enum.NodeStatus.READY]
+                ):
+                    nodes.append(node)
+            self._maas_nodes = nodes
+        return self._maas_nodes
+
+    def create(self, workers=1):
         raise NotImplementedError
 
 
 class VirtualInterfacesCreator(Creator):
 
+    @staticmethod
+    def get_node_interfaces(maas_node):
+        return [
+            NodeInterface(
+                name=iface.name, type=iface.type, enabled=iface.enabled,
+                mac_address=iface.mac_address, mtu=iface.effective_mtu,
+                vid=iface.vlan.vid if iface.vlan else None,
+                parents=[parent.name for parent in iface.parents],
+                ipv4=maas.get_interface_ipv4_address(iface))
+            for iface in maas_node.interfaces]
+
     def get_iface_data(self, iface, node_id):
         iface_data = {
             'device': node_id,
             'name': iface.name,
             'enabled': iface.enabled,
             'mac_address': iface.mac_address,
-            'mtu': iface.effective_mtu
+            'mtu': iface.mtu
         }
 
-        if iface.vlan and iface.vlan.vid != 0:
+        if iface.vid:
             iface_data['mode'] = 200
-            vlan = self.netbox_api.get_vlan_id(iface.vlan.vid)
+            vlan = self.netbox_api.get_vlan_id(iface.vid)
             iface_data['tagged_vlans'] = [vlan]
         else:
             iface_data['mode'] = 100
@@ -85,21 +116,22 @@ class VirtualInterfacesCreator(Creator):
             ifaces_dict[iface.name] = iface.id
         return ifaces_dict
 
-    def create_interfaces(self, maas_node, netbox_node, netbox_node_ifaces):
-        for iface in maas_node.interfaces:
+    def create_interfaces(self, node_ifaces, netbox_node, netbox_node_ifaces):
+        ifaces_data = []
+        for iface in node_ifaces:
             if iface.type != enum.InterfaceType.UNKNOWN:
                 if iface.name not in netbox_node_ifaces:
-                    iface_data = self.get_iface_data(iface, netbox_node)
-                    netbox_iface_id = self.netbox_api.create_interface(
-                        iface_data)
-                    netbox_node_ifaces[iface.name] = netbox_iface_id
+                    ifaces_data.append(self.get_iface_data(iface, netbox_node))
+        netbox_iface_ids = self.netbox_api.create_interfaces(ifaces_data)
+        for iface_data, netbox_iface_id in zip(ifaces_data, netbox_iface_ids):
+            netbox_node_ifaces[iface_data['name']] = netbox_iface_id
 
-    def patch_parent_interfaces(self, maas_node, netbox_node_ifaces):
-        for iface in maas_node.interfaces:
+    def patch_parent_interfaces(self, node_ifaces, netbox_node_ifaces):
+        for iface in node_ifaces:
             if iface.type != enum.InterfaceType.UNKNOWN:
                 netbox_iface_id = netbox_node_ifaces[iface.name]
                 for iface_parent in iface.parents:
-                    netbox_parent_iface = netbox_node_ifaces[iface_parent.name]
+                    netbox_parent_iface = netbox_node_ifaces[iface_parent]
                     if iface.type == enum.InterfaceType.BOND:
                         self.netbox_api.patch_interface(
                             netbox_parent_iface, {'lag': netbox_iface_id})
@@ -110,31 +142,40 @@ class VirtualInterfacesCreator(Creator):
                         self.netbox_api.patch_interface(
                             netbox_iface_id, {'lag': netbox_parent_iface})
 
-    def create_ip_addresses(self, maas_node, netbox_node, netbox_node_ifaces):
-        for iface in maas_node.interfaces:
-            ipv4 = maas.get_interface_ipv4_address(iface)
-            if ipv4:
+    def create_ip_addresses(self, node_ifaces, netbox_node,
+                            netbox_node_ifaces):
+        ips_data = []
+        primary = []
+        for iface in node_ifaces:
+            ipv4 = iface.ipv4
+            if ipv4 and ipv4 not in [ip['address'] for ip in ips_data]:
                 netbox_iface_id = netbox_node_ifaces[iface.name]
                 ip_data = {
                     "address": ipv4,
                     "status": 1,
                     "interface": netbox_iface_id,
                 }
-                if not self.netbox_api.get_ip_address(ipv4):
-                    address_id = self.netbox_api.create_ip_address(ip_data)
-                    if address_id and iface.vlan.vid == 0:
-                        self.netbox_api.patch_node(
-                            netbox_node, {'primary_ip4': address_id})
-
-    def update_physical_interfaces(self, maas_node, netbox_node_ifaces):
-        for iface in maas_node.interfaces:
+                if not self.netbox_api.has_ip_address(ipv4):
+                    ips_data.append(ip_data)
+                    primary.append(iface.vid == 0)
+
+        address_ids = self.netbox_api.create_ip_addresses(ips_data)
+        primary_ids = [
+            address_id for address_id, is_primary in zip(address_ids, primary)
+            if address_id and is_primary]
+        if primary_ids:
+            self.netbox_api.patch_node(
+                netbox_node, {'primary_ip4': primary_ids[-1]})
+
+    def update_physical_interfaces(self, node_ifaces, netbox_node_ifaces):
+        for iface in node_ifaces:
             if iface.type == enum.InterfaceType.PHYSICAL:
                 iface_data = {
-                    'mtu': iface.effective_mtu
+                    'mtu': iface.mtu
                 }
-                if iface.vlan and iface.vlan.vid != 0:
+                if iface.vid:
                     iface_data['mode'] = 200
-                    vlan = self.netbox_api.get_vlan_id(iface.vlan.vid)
+                    vlan = self.netbox_api.get_vlan_id(iface.vid)
                     iface_data['tagged_vlans'] = [vlan]
                 else:
                     iface_data['mode'] = 100
@@ -154,8 +195,13 @@ class VirtualInterfacesCreator(Creator):
             data['color'] = color
         return data
 
-    def create_switch_connections(self, maas_node, netbox_node_ifaces):
-        ifaces_details = maas.get_switch_connection_details(maas_node)
+    def get_switch_connection_details(self, maas_node):
+        hardware = self.snapshot.get_nodes_hardware(
+            [maas_node])[maas_node.system_id]
+        return hardware.switch_connections if hardware else []
+
+    def create_switch_connections(self, ifaces_details, netbox_node_ifaces):
+        cables_data = []
         for iface in ifaces_details:
             netbox_iface_id = netbox_node_ifaces[iface['name']]
             netbox_iface = self.netbox_api.get_node_interface(netbox_iface_id)
@@ -167,41 +213,93 @@ class VirtualInterfacesCreator(Creator):
                 self.netbox_api.patch_interface(
                     netbox_iface.lag.id, data)
 
-            switch = self.netbox_api.get_node_by_name(iface['switch_name'])
-            switch_port = self.netbox_api.get_node_interfaces(
-                switch.id, iface['switch_port'])[0]
+            switch_port = self.netbox_api.get_switch_port(
+                iface['switch_name'], iface['switch_port'])
+            if not switch_port:
+                logging.error('Switch port {} {} is missing'.format(
+                    iface['switch_name'], iface['switch_port']))
+                continue
             if not self.netbox_api.get_cable(
                     netbox_iface_id, switch_port.id):
-                cable_data = self.get_cable_data(
-                    netbox_iface_id, switch_port.id, iface['cable_color'])
-                self.netbox_api.create_cable(cable_data)
+                cables_data.append(self.get_cable_data(
+                    netbox_iface_id, switch_port.id, iface['cable_color']))
 
-    def create(self):
-        for maas_node in self.maas_nodes:
-            try:
-                netbox_node = self.netbox_nodes[maas_node.hostname]
-            except KeyError:
-                continue
+        self.netbox_api.create_cables(cables_data)
+
+    def prefetch(self):
+        """Read everything nodes share before workers start"""
+        maas_nodes = [
+            maas_node for maas_node in self.maas_nodes
+            if maas_node.hostname in self.netbox_nodes]
+        self.snapshot.get_nodes_hardware(maas_nodes)
+        self.netbox_api.load_switch_ports(
+            iface['switch_name'] for maas_node in maas_nodes
+            for iface in self.get_switch_connection_details(maas_node))
+        self.netbox_api.reference_data
+        self.netbox_api.cables
+        if self.netbox_api.mirror:
+            self.netbox_api.interfaces_by_node
+
+    def prefetch_ip_addresses(self, jobs):
+        """Load the prefixes of planned addresses before workers start"""
+        for address in set(
+                iface.ipv4 for job in jobs for iface in job[2] if iface.ipv4):
+            self.netbox_api.has_ip_address(address)
+
+    def update_node(self, hostname, netbox_node, node_ifaces,
+                    switch_connections):
+        logging.info('Updating Node: {}...'.format(hostname.upper()))
+
+        netbox_node_ifaces = self.get_netbox_node_ifaces_dict(netbox_node)
+
+        # create interface if not present
+        self.create_interfaces(node_ifaces, netbox_node, netbox_node_ifaces)
 
-            logging.info(
-                'Updating Node: {}...'.format(
-                    maas_node.hostname.upper()))
+        # update physical interfaces
+        self.update_physical_interfaces(node_ifaces, netbox_node_ifaces)
 
-            netbox_node_ifaces = self.get_netbox_node_ifaces_dict(netbox_node)
+        # patch parent interfaces to let them know they are part of this
+        # LAG
+        self.patch_parent_interfaces(node_ifaces, netbox_node_ifaces)
 
-            # create interface if not present
-            self.create_interfaces(maas_node, netbox_node, netbox_node_ifaces)
+        # Create IP addresses of all interfaces of the node
+        self.create_ip_addresses(node_ifaces, netbox_node, netbox_node_ifaces)
 
-            # update physical interfaces
-            self.update_physical_interfaces(maas_node, netbox_node_ifaces)
+        # Create Switch Connections
+        self.create_switch_connections(switch_connections, netbox_node_ifaces)
 
-            # patch parent interfaces to let them know they are part of this
-            # LAG
-            self.patch_parent_interfaces(maas_node, netbox_node_ifaces)
+    def try_update_node(self, job):
+        """Update a node, returning the error that stopped it if any"""
+        try:
+            self.update_node(*job)
+        except Exception as e:
+            logging.exception('Node {} failed'.format(job[0].upper()))
+            return e
 
-            # Create IP addresses of all interfaces of the node
-            self.create_ip_addresses(
-                maas_node, netbox_node, netbox_node_ifaces)
+    def create(self, workers=1):
+        """Update nodes, up to `workers` at a time, returning failures"""
+        self.prefetch()
+        jobs = []
+        for maas_node in self.maas_nodes:
+            try:
+                netbox_node = self.netbox_nodes[maas_node.hostname]
+            except KeyError:
+                continue
+            jobs.append((
+                maas_node.hostname, netbox_node,
+                self.get_node_interfaces(maas_node),
+                self.get_switch_connection_details(maas_node)))
+        self.prefetch_ip_addresses(jobs)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                errors = list(executor.map(self.try_update_node, jobs))
+        else:
+            errors = [self.try_update_node(job) for job in jobs]
 
-            # Create Switch Connections
-            self.create_switch_connections(maas_node, netbox_node_ifaces)
+        failed = {
+            job[0]: str(error) for job, error in zip(jobs, errors) if error}
+        if failed:
+            logging.error('{} of {} nodes failed: {}'.format(
+                len(failed), len(jobs), ', '.join(sorted(failed))))
+        return failed
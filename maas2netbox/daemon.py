@@ -0,0 +1,195 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Long-running reconciliation with warm inventories"""
+
+import hmac
+import json
+import logging
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from maas2netbox.records import serialize
+from maas2netbox.snapshot import Snapshot
+
+
+class Reconciler(object):
+    """Validates queued fields against a snapshot kept between runs"""
+
+    def __init__(self, get_validator, fields, snapshot=None):
+        self.get_validator = get_validator
+        self.fields = fields
+        self.snapshot = snapshot or Snapshot()
+        self.jobs = queue.Queue()
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def submit(self, field):
+        self.jobs.put(field)
+
+    def get_results(self, field=None):
+        with self.lock:
+            if field is None:
+                return dict(self.results)
+            return self.results.get(field)
+
+    def take_jobs(self, timeout):
+        """Fields queued within `timeout` seconds, duplicates merged"""
+        try:
+            fields = [self.jobs.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                fields.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        selected = set()
+        for field in fields:
+            selected.update(self.fields if field == 'all' else [field])
+        return [field for field in self.fields if field in selected] + [
+            field for field in sorted(selected) if field not in self.fields]
+
+    def reconcile(self, fields):
+        """Validate fields, reading only listings again"""
+        started = time.time()
+        self.snapshot.refresh(keep_hardware=True)
+        self.snapshot.netbox_api.refresh()
+        for field in fields:
+            try:
+                errors = self.get_validator(
+                    field, self.snapshot).check_nodes()
+            except Exception:
+                logging.exception('Validation of {} failed'.format(field))
+                continue
+            with self.lock:
+                self.results[field] = {
+                    'finished': time.time(), 'errors': errors}
+        logging.info('Validated {} in {:.2f}s'.format(
+            ', '.join(fields), time.time() - started))
+
+    def run(self, interval=None):
+        """Validate queued fields, and all of them every `interval` seconds"""
+        # Validations stay on this thread, the MaaS client is bound to it
+        self.submit('all')
+        next_run = time.time() + (interval or 0)
+        while True:
+            if interval:
+                if time.time() >= next_run:
+                    self.submit('all')
+                    next_run = time.time() + interval
+                timeout = max(next_run - time.time(), 0)
+            else:
+                timeout = None
+            fields = self.take_jobs(timeout)
+            if fields:
+                self.reconcile(fields)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Queue validations and report their results as JSON"""
+
+    server_version = 'maas2netbox'
+
+    def send_json(self, status, data):
+        body = json.dumps(data, default=serialize).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_path(self):
+        return [part for part in self.path.split('?')[0].split('/') if part]
+
+    def authorized(self):
+        """Check the token of the request, answering 403 if it is wrong"""
+        token = self.server.token
+        if not token:
+            return True
+        expected = 'Token {}'.format(token).encode('utf-8')
+        actual = (self.headers.get('Authorization') or '').encode('utf-8')
+        if hmac.compare_digest(expected, actual):
+            return True
+        self.send_json(403, {'error': 'Invalid token'})
+        return False
+
+    def do_GET(self):
+        path = self.get_path()
+        reconciler = self.server.reconciler
+        if path == ['health']:
+            self.send_json(200, {'status': 'ok'})
+        elif not self.authorized():
+            return
+        elif path == ['results']:
+            self.send_json(200, reconciler.get_results())
+        elif len(path) == 2 and path[0] == 'results':
+            results = reconciler.get_results(path[1])
+            if results is None:
+                self.send_json(404, {'error': 'No results for that field'})
+            else:
+                self.send_json(200, results)
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        path = self.get_path()
+        if not self.authorized():
+            return
+        # Hook payloads are not needed, any change triggers a validation
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {'error': 'Invalid Content-Length'})
+            return
+        if length:
+            self.rfile.read(length)
+
+        if path == ['webhook']:
+            self.server.reconciler.submit('all')
+            self.send_json(202, {'queued': 'all'})
+        elif (
+            len(path) == 2 and path[0] == 'validate'
+            and path[1] in self.server.fields
+        ):
+            self.server.reconciler.submit(path[1])
+            self.send_json(202, {'queued': path[1]})
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        logging.debug('{} {}'.format(self.address_string(), format % args))
+
+
+class Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_server(reconciler, fields, host, port, token=None):
+    """Serve the HTTP endpoint from a background thread"""
+    server = Server((host, port), RequestHandler)
+    server.reconciler = reconciler
+    server.fields = fields
+    server.token = token
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info('Listening on {}:{}'.format(*server.server_address[:2]))
+    return server
@@ -0,0 +1,101 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Change plans written by validate and applied by update"""
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+from maas2netbox.records import NetBoxNode, serialize
+from maas2netbox.validators import get_ifaces_index
+
+PLAN_VERSION = 1
+
+# Fields whose fingerprints cover the interfaces of the device
+INTERFACE_FIELDS = ('interfaces',)
+
+
+def write_plan(path, changes):
+    """Write the changes of each field, skipping fields with no result"""
+    plan = {
+        'version': PLAN_VERSION,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'fields': {
+            field: {str(node_id): change
+                    for node_id, change in nodes_with_errors.items()}
+            for field, nodes_with_errors in changes.items()
+            if nodes_with_errors is not None
+        },
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(plan, f, indent=2, sort_keys=True, default=serialize)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logging.info('Plan written to {}'.format(path))
+
+
+def read_plan(path):
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(
+            'Unsupported plan version: {}'.format(plan.get('version')))
+
+    return {
+        field: {int(node_id): change for node_id, change in changes.items()}
+        for field, changes in plan['fields'].items()
+    }
+
+
+def drop_stale_changes(changes, netbox_api):
+    """Leave out changes of devices modified since the plan was written"""
+    node_ids = set(
+        node_id for nodes_with_errors in changes.values()
+        for node_id in nodes_with_errors)
+    nodes = {
+        node.id: NetBoxNode.from_device(node)
+        for node in netbox_api.get_nodes_by_id(node_ids)}
+    iface_node_ids = set(
+        node_id for field in INTERFACE_FIELDS
+        for node_id in changes.get(field, {}) if node_id in nodes)
+    ifaces_index = get_ifaces_index(
+        netbox_api.get_nodes_interfaces(sorted(iface_node_ids))
+        if iface_node_ids else [])
+
+    for field, nodes_with_errors in changes.items():
+        for node_id, change in list(nodes_with_errors.items()):
+            node = nodes.get(node_id)
+            if node is None:
+                fingerprint = None
+            elif field in INTERFACE_FIELDS:
+                fingerprint = node.interfaces_fingerprint(
+                    ifaces_index.get(node_id, ()))
+            else:
+                fingerprint = node.fingerprint()
+            if fingerprint != change.get('fingerprint'):
+                logging.warning(
+                    'Node {} changed since the plan was written, '
+                    'skipping its {} update'.format(node_id, field))
+                del nodes_with_errors[node_id]
+
+    return changes
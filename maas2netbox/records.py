@@ -0,0 +1,127 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compact records of the fields reconciled between MaaS and NetBox"""
+
+import hashlib
+import json
+
+SANITIZED_STATUSES = ('DEPLOYED', 'READY')
+
+
+def serialize(obj):
+    """JSON encoder fallback for records"""
+    return obj.serialize()
+
+
+class Record(object):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__)
+
+    def __hash__(self):
+        # Parsed hardware holds lists, so only the identifier is hashed
+        return hash(getattr(self, self.__slots__[0]))
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.name)
+
+    def serialize(self):
+        return dict(
+            (name, getattr(self, name)) for name in self.__slots__)
+
+    def fingerprint(self, **extra):
+        """Short digest of the record and `extra` fields"""
+        values = self.serialize()
+        values.update(extra)
+        data = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+class MaaSNode(Record):
+    """A MaaS machine, with its commissioning details once fetched"""
+
+    __slots__ = ('system_id', 'hostname', 'status', 'platform',
+                 'primary_ipv4', 'hardware')
+
+    def __init__(self, system_id, hostname, status, platform=None,
+                 primary_ipv4=None, hardware=None):
+        self.system_id = system_id
+        self.hostname = hostname
+        self.status = status
+        self.platform = platform
+        self.primary_ipv4 = primary_ipv4
+        self.hardware = hardware
+
+    @property
+    def name(self):
+        return self.hostname
+
+    @property
+    def sanitized(self):
+        return self.status in SANITIZED_STATUSES
+
+    @classmethod
+    def from_machine(cls, machine, hardware=None):
+        """Keep the reconciled fields of a python-libmaas machine"""
+        if machine.osystem and machine.distro_series:
+            platform = '{}-{}'.format(machine.osystem, machine.distro_series)
+        else:
+            platform = None
+        try:
+            bond = machine.interfaces.get_by_name('bond0')
+            primary_ipv4 = bond.links[0].ip_address or None
+        except (KeyError, IndexError, AttributeError):
+            primary_ipv4 = None
+
+        return cls(machine.system_id, machine.hostname, machine.status.name,
+                   platform, primary_ipv4, hardware)
+
+
+class NetBoxNode(Record):
+    """A NetBox device, with nested objects reduced to plain values"""
+
+    __slots__ = ('id', 'name', 'serial', 'status', 'primary_ip4',
+                 'platform', 'comments')
+
+    def __init__(self, id, name, serial=None, status=None, primary_ip4=None,
+                 platform=None, comments=None):
+        self.id = id
+        self.name = name
+        self.serial = serial
+        self.status = status
+        self.primary_ip4 = primary_ip4
+        self.platform = platform
+        self.comments = comments
+
+    @classmethod
+    def from_device(cls, device):
+        """Keep the reconciled fields of a NetBox device"""
+        status = device.status.label if device.status else None
+        primary_ip4 = device.primary_ip4.address \
+            if device.primary_ip4 else None
+        platform = device.platform.slug if device.platform else None
+
+        return cls(device.id, device.name, device.serial, status,
+                   primary_ip4, platform, device.comments)
+
+    def interfaces_fingerprint(self, interfaces):
+        """Fingerprint also covering the (name, MAC) of device interfaces"""
+        return self.fingerprint(interfaces=sorted(
+            ([name, mac_address] for name, mac_address in interfaces),
+            key=str))
@@ -0,0 +1,104 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from maas2netbox.records import MaaSNode, NetBoxNode, SANITIZED_STATUSES
+from maas2netbox.utils import maas, netbox
+
+
+class Snapshot(object):
+    """In-memory view of both inventories shared by validators"""
+
+    def __init__(self, netbox_api=None, retain=True, tracker=None):
+        self.netbox_api = netbox_api or netbox.get_netbox_api()
+        self.retain = retain
+        self.tracker = tracker
+        self.refresh()
+
+    def refresh(self, keep_hardware=False):
+        """Forget fetched data, keeping hardware details if asked"""
+        self._netbox_nodes = None
+        self._maas_nodes = None
+        self._maas_hardware = False
+        if not keep_hardware:
+            self._hardware = {}
+            self._hardware_markers = {}
+
+    @property
+    def netbox_nodes(self):
+        if self._netbox_nodes is None:
+            self._netbox_nodes = [
+                NetBoxNode.from_device(node)
+                for node in self.netbox_api.get_nodes()]
+        return self._netbox_nodes
+
+    def iter_netbox_pages(self):
+        if self._netbox_nodes is not None:
+            yield self._netbox_nodes
+            return
+
+        pages = []
+        for page in self.netbox_api.iter_nodes_pages():
+            page = [NetBoxNode.from_device(node) for node in page]
+            if self.retain:
+                pages.append(page)
+            yield page
+        if self.retain:
+            self._netbox_nodes = [node for page in pages for node in page]
+
+    def iter_netbox_nodes(self):
+        for page in self.iter_netbox_pages():
+            for node in page:
+                yield node
+
+    @property
+    def maas_nodes(self):
+        return self.load_maas_nodes()
+
+    def load_maas_nodes(self, hardware=False):
+        """MaaS machines as records, hardware of sanitized ones if asked"""
+        if self._maas_nodes is None or (hardware and not self._maas_hardware):
+            machines = list(maas.get_nodes())
+            if self.tracker:
+                machines = self.tracker.changed(machines)
+            if hardware:
+                sanitized = [
+                    machine for machine in machines
+                    if machine.status.name in SANITIZED_STATUSES]
+                nodes_hardware = self.get_nodes_hardware(sanitized)
+                if self.tracker:
+                    self.tracker.discard(
+                        machine.system_id for machine in sanitized
+                        if nodes_hardware[machine.system_id] is None)
+            self._maas_nodes = [
+                MaaSNode.from_machine(
+                    machine, self._hardware.get(machine.system_id))
+                for machine in machines]
+            self._maas_hardware = self._maas_hardware or hardware
+        return self._maas_nodes
+
+    def get_nodes_hardware(self, nodes):
+        """Parsed commissioning details of MaaS machines, fetched once"""
+        missing = [
+            node for node in nodes if node.system_id not in self._hardware
+            or self._hardware_markers[node.system_id]
+            != maas.get_commissioning_marker(node)]
+        if missing:
+            nodes_hardware = maas.get_nodes_hardware(missing)
+            for node in missing:
+                self._hardware[node.system_id] = nodes_hardware.get(
+                    node.system_id)
+                self._hardware_markers[node.system_id] = \
+                    maas.get_commissioning_marker(node)
+        return self._hardware
@@ -0,0 +1,379 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""SQLite store of both inventories, for validation without the live APIs"""
+
+import datetime
+import logging
+import sqlite3
+import threading
+
+from maas2netbox.records import MaaSNode, NetBoxNode
+from maas2netbox.snapshot import Snapshot
+from maas2netbox.utils.maas import NodeHardware
+from maas2netbox.utils.netbox import chunks, Item
+
+# Ids bound in a single query, below the SQLite limit of 999 parameters
+SQL_CHUNK_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS maas_nodes (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    system_id TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    status TEXT,
+    platform TEXT,
+    primary_ipv4 TEXT,
+    has_hardware INTEGER NOT NULL,
+    serial TEXT,
+    PRIMARY KEY (snapshot_id, system_id)
+);
+CREATE INDEX IF NOT EXISTS maas_nodes_hostname
+    ON maas_nodes (snapshot_id, hostname);
+CREATE TABLE IF NOT EXISTS maas_interfaces (
+    snapshot_id INTEGER NOT NULL,
+    system_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    mac_address TEXT,
+    type TEXT,
+    PRIMARY KEY (snapshot_id, system_id, position)
+);
+CREATE TABLE IF NOT EXISTS maas_switch_connections (
+    snapshot_id INTEGER NOT NULL,
+    system_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    switch_name TEXT,
+    switch_port TEXT,
+    vid TEXT,
+    cable_color TEXT,
+    PRIMARY KEY (snapshot_id, system_id, position)
+);
+CREATE TABLE IF NOT EXISTS netbox_devices (
+    snapshot_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT,
+    serial TEXT,
+    status TEXT,
+    primary_ip4 TEXT,
+    platform TEXT,
+    comments TEXT,
+    PRIMARY KEY (snapshot_id, id)
+);
+CREATE INDEX IF NOT EXISTS netbox_devices_name
+    ON netbox_devices (snapshot_id, name);
+CREATE TABLE IF NOT EXISTS netbox_switches (
+    snapshot_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, id)
+);
+CREATE TABLE IF NOT EXISTS netbox_interfaces (
+    snapshot_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    device_id INTEGER NOT NULL,
+    name TEXT,
+    mac_address TEXT,
+    lag_id INTEGER,
+    untagged_vlan_id INTEGER,
+    PRIMARY KEY (snapshot_id, id)
+);
+CREATE INDEX IF NOT EXISTS netbox_interfaces_device
+    ON netbox_interfaces (snapshot_id, device_id, name);
+CREATE TABLE IF NOT EXISTS netbox_cables (
+    snapshot_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    termination_a_id INTEGER NOT NULL,
+    termination_b_id INTEGER NOT NULL,
+    color TEXT,
+    PRIMARY KEY (snapshot_id, id)
+);
+CREATE INDEX IF NOT EXISTS netbox_cables_terminations
+    ON netbox_cables (snapshot_id, termination_a_id, termination_b_id);
+CREATE TABLE IF NOT EXISTS netbox_vlans (
+    snapshot_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    vid TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, id)
+);
+"""
+
+
+def get_id(item):
+    return item.id if item else None
+
+
+class SnapshotStore(object):
+    """Snapshots of MaaS machines and NetBox objects in a SQLite database"""
+
+    def __init__(self, path):
+        # Validators may query from worker threads, one at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def has_snapshot(self, snapshot_id):
+        return bool(self.query(
+            'SELECT 1 FROM snapshots WHERE id = ?', snapshot_id))
+
+    def latest_id(self):
+        row = self.query('SELECT MAX(id) FROM snapshots')[0]
+        if row[0] is None:
+            raise LookupError('No snapshot has been recorded')
+        return row[0]
+
+    def record(self, snapshot):
+        """Store both sides of a live snapshot and return its id"""
+        netbox_api = snapshot.netbox_api
+        maas_nodes = snapshot.load_maas_nodes(hardware=True)
+        netbox_nodes = snapshot.netbox_nodes
+        switch_names = set(
+            iface['switch_name'] for node in maas_nodes if node.hardware
+            for iface in node.hardware.switch_connections)
+        netbox_api.load_switch_ports(switch_names)
+        switches = [
+            switch for switch in (
+                netbox_api.get_switch(name) for name in sorted(switch_names))
+            if switch]
+        interfaces = netbox_api.get_nodes_interfaces(
+            [node.id for node in netbox_nodes])
+        switch_ports = netbox_api.get_nodes_interfaces(
+            [switch.id for switch in switches], brief=True)
+        cables = dict(
+            (cable.id, cable) for cable in netbox_api.cables.values())
+        vlans = netbox_api.reference_data['vlans']
+
+        with self.connection:
+            snapshot_id = self.connection.execute(
+                'INSERT INTO snapshots (created) VALUES (?)',
+                (datetime.datetime.utcnow().isoformat(),)).lastrowid
+            self.insert_maas_nodes(snapshot_id, maas_nodes)
+            self.connection.executemany(
+                'INSERT INTO netbox_devices VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((snapshot_id, node.id, node.name, node.serial, node.status,
+                  node.primary_ip4, node.platform, node.comments)
+                 for node in netbox_nodes))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO netbox_switches VALUES (?, ?, ?)',
+                ((snapshot_id, switch.id, switch.name)
+                 for switch in switches))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO netbox_interfaces '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((snapshot_id, iface.id, iface.device.id, iface.name,
+                  getattr(iface, 'mac_address', None),
+                  get_id(getattr(iface, 'lag', None)),
+                  get_id(getattr(iface, 'untagged_vlan', None)))
+                 for iface in interfaces + switch_ports))
+            self.connection.executemany(
+                'INSERT INTO netbox_cables VALUES (?, ?, ?, ?, ?)',
+                ((snapshot_id, cable.id, cable.termination_a_id,
+                  cable.termination_b_id, cable.color)
+                 for cable in cables.values()))
+            self.connection.executemany(
+                'INSERT INTO netbox_vlans VALUES (?, ?, ?)',
+                ((snapshot_id, vlan_id, vid)
+                 for vid, vlan_id in vlans.items()))
+
+        logging.info('Recorded snapshot {}: {} MaaS nodes, {} NetBox nodes'
+                     .format(snapshot_id, len(maas_nodes), len(netbox_nodes)))
+        return snapshot_id
+
+    def insert_maas_nodes(self, snapshot_id, nodes):
+        for node in nodes:
+            hardware = node.hardware
+            self.connection.execute(
+                'INSERT INTO maas_nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (snapshot_id, node.system_id, node.hostname, node.status,
+                 node.platform, node.primary_ipv4, hardware is not None,
+                 hardware.serial if hardware else None))
+            if not hardware:
+                continue
+            self.connection.executemany(
+                'INSERT INTO maas_interfaces VALUES (?, ?, ?, ?, ?, ?)',
+                ((snapshot_id, node.system_id, position, iface.get('name'),
+                  iface.get('mac_address'), iface.get('type'))
+                 for position, iface in enumerate(hardware.interfaces)))
+            self.connection.executemany(
+                'INSERT INTO maas_switch_connections '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((snapshot_id, node.system_id, position, iface['name'],
+                  iface['switch_name'], iface['switch_port'], iface['vid'],
+                  iface['cable_color'])
+                 for position, iface in enumerate(
+                     hardware.switch_connections)))
+
+    def query(self, sql, *params):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def load_maas_nodes(self, snapshot_id):
+        interfaces = {}
+        for system_id, name, mac_address, iface_type in self.query(
+                'SELECT system_id, name, mac_address, type '
+                'FROM maas_interfaces WHERE snapshot_id = ? '
+                'ORDER BY system_id, position', snapshot_id):
+            iface = {'name': name, 'mac_address': mac_address}
+            if iface_type is not None:
+                iface['type'] = iface_type
+            interfaces.setdefault(system_id, []).append(iface)
+
+        switch_connections = {}
+        for row in self.query(
+                'SELECT system_id, name, switch_name, switch_port, vid, '
+                'cable_color FROM maas_switch_connections '
+                'WHERE snapshot_id = ? ORDER BY system_id, position',
+                snapshot_id):
+            switch_connections.setdefault(row[0], []).append(dict(zip(
+                ('name', 'switch_name', 'switch_port', 'vid', 'cable_color'),
+                row[1:])))
+
+        nodes = []
+        for row in self.query(
+                'SELECT system_id, hostname, status, platform, primary_ipv4, '
+                'has_hardware, serial FROM maas_nodes WHERE snapshot_id = ? '
+                'ORDER BY hostname', snapshot_id):
+            system_id = row[0]
+            hardware = NodeHardware(
+                serial=row[6], interfaces=interfaces.get(system_id, []),
+                switch_connections=switch_connections.get(system_id, [])
+            ) if row[5] else None
+            nodes.append(MaaSNode(*row[:5], hardware=hardware))
+        return nodes
+
+    def load_netbox_nodes(self, snapshot_id):
+        return [
+            NetBoxNode(*row) for row in self.query(
+                'SELECT id, name, serial, status, primary_ip4, platform, '
+                'comments FROM netbox_devices WHERE snapshot_id = ? '
+                'ORDER BY name', snapshot_id)]
+
+
+class StoredNetBoxAPI(object):
+    """Read-only NetBox lookups of validators, answered from a snapshot"""
+
+    def __init__(self, store, snapshot_id):
+        self.store = store
+        self.snapshot_id = snapshot_id
+
+    @staticmethod
+    def load_interface(row):
+        iface_id, device_id, name, mac_address, lag_id, vlan_id = row
+        return Item({
+            'id': iface_id,
+            'device': {'id': device_id},
+            'name': name,
+            'mac_address': mac_address,
+            'lag': {'id': lag_id} if lag_id is not None else None,
+            'untagged_vlan':
+                {'id': vlan_id} if vlan_id is not None else None,
+        })
+
+    def query_interfaces(self, where, *params):
+        return [
+            self.load_interface(row) for row in self.store.query(
+                'SELECT id, device_id, name, mac_address, lag_id, '
+                'untagged_vlan_id FROM netbox_interfaces '
+                'WHERE snapshot_id = ? AND ' + where,
+                self.snapshot_id, *params)]
+
+    def get_nodes_interfaces(self, node_ids, brief=False):
+        interfaces = []
+        for chunk in chunks(node_ids, SQL_CHUNK_SIZE):
+            interfaces.extend(self.query_interfaces(
+                'device_id IN ({})'.format(','.join('?' * len(chunk))),
+                *chunk))
+        return interfaces
+
+    def get_node_interfaces(self, node_id, name=''):
+        if name:
+            return self.query_interfaces(
+                'device_id = ? AND name = ?', node_id, name)
+        return self.query_interfaces('device_id = ?', node_id)
+
+    def get_node_interface(self, interface_id):
+        interfaces = self.query_interfaces('id = ?', interface_id)
+        return interfaces[0] if interfaces else None
+
+    def load_switch_ports(self, switch_names):
+        pass
+
+    def get_switch(self, name):
+        rows = self.store.query(
+            'SELECT id, name FROM netbox_switches '
+            'WHERE snapshot_id = ? AND lower(name) = ?',
+            self.snapshot_id, name.lower())
+        return Item({'id': rows[0][0], 'name': rows[0][1]}) if rows else None
+
+    def get_switch_port(self, switch_name, port):
+        switch = self.get_switch(switch_name)
+        if not switch:
+            return None
+        interfaces = self.query_interfaces(
+            'device_id = ? AND name = ?', switch.id, port)
+        return interfaces[0] if interfaces else None
+
+    def get_vlan_id(self, vid):
+        rows = self.store.query(
+            'SELECT id FROM netbox_vlans WHERE snapshot_id = ? AND vid = ?',
+            self.snapshot_id, str(vid))
+        return rows[0][0] if rows else None
+
+    def get_cable(self, node_iface, switch_iface):
+        rows = self.store.query(
+            'SELECT id, color FROM netbox_cables WHERE snapshot_id = ? AND ('
+            '(termination_a_id = ? AND termination_b_id = ?) OR '
+            '(termination_a_id = ? AND termination_b_id = ?))',
+            self.snapshot_id, node_iface, switch_iface, switch_iface,
+            node_iface)
+        return Item({'id': rows[0][0], 'color': rows[0][1]}) if rows else None
+
+
+class StoredSnapshot(Snapshot):
+    """Snapshot read from the store instead of MaaS and NetBox"""
+
+    def __init__(self, store, snapshot_id=None):
+        self.store = store
+        if snapshot_id is None:
+            snapshot_id = store.latest_id()
+        elif not store.has_snapshot(snapshot_id):
+            raise LookupError('No snapshot {} in the store'.format(
+                snapshot_id))
+        self.snapshot_id = snapshot_id
+        super(StoredSnapshot, self).__init__(
+            StoredNetBoxAPI(store, self.snapshot_id))
+
+    @property
+    def netbox_nodes(self):
+        if self._netbox_nodes is None:
+            self._netbox_nodes = self.store.load_netbox_nodes(
+                self.snapshot_id)
+        return self._netbox_nodes
+
+    def iter_netbox_pages(self):
+        yield self.netbox_nodes
+
+    def load_maas_nodes(self, hardware=False):
+        if self._maas_nodes is None:
+            self._maas_nodes = self.store.load_maas_nodes(self.snapshot_id)
+        return self._maas_nodes
@@ -0,0 +1,72 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import time
+
+from maas2netbox import config
+from maas2netbox.utils import cache, maas
+
+
+class ChangeTracker(object):
+    """MaaS machines changed since the previous incremental update"""
+
+    def __init__(self, name, sweep_interval=None):
+        self.cache = cache.get_cache('sync')
+        self.key = 'maas-fingerprints:{}'.format(name)
+        if sweep_interval is None:
+            sweep_interval = config.maas_sweep_interval
+
+        state = self.cache.get(self.key) if self.cache else None
+        if self.cache is None:
+            logging.warning(
+                'No cache directory set, incremental mode checks all nodes')
+        if state and state['swept'] + sweep_interval > time.time():
+            self.swept = state['swept']
+            self.previous = state['fingerprints']
+            self.full_sweep = False
+        else:
+            self.swept = time.time()
+            self.previous = {}
+            self.full_sweep = True
+        self.fingerprints = dict(self.previous)
+
+    def changed(self, machines):
+        """Machines whose fingerprint differs from the previous run"""
+        changed = []
+        for machine in machines:
+            fingerprint = maas.get_machine_fingerprint(machine)
+            if self.previous.get(machine.system_id) != fingerprint:
+                changed.append(machine)
+            self.fingerprints[machine.system_id] = fingerprint
+
+        logging.info('{} of {} nodes changed{}'.format(
+            len(changed), len(machines),
+            ' (full sweep)' if self.full_sweep else ''))
+        return changed
+
+    def discard(self, system_ids):
+        """Check machines again on the next run, e.g. when they failed"""
+        for system_id in system_ids:
+            if system_id in self.previous:
+                self.fingerprints[system_id] = self.previous[system_id]
+            else:
+                self.fingerprints.pop(system_id, None)
+
+    def save(self):
+        """Remember fingerprints once the run has completed"""
+        if self.cache:
+            self.cache.set(self.key, {
+                'swept': self.swept, 'fingerprints': self.fingerprints})
@@ -0,0 +1,67 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from mock import patch, Mock
+
+
+class FileCacheTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox.utils import cache
+        self.cache = cache
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def test_get_set_delete(self):
+        file_cache = self.cache.FileCache(self.directory)
+        self.assertIsNone(file_cache.get('key'))
+
+        file_cache.set('key', {'a': 1})
+        self.assertEqual({'a': 1}, file_cache.get('key'))
+
+        file_cache.delete('key')
+        self.assertIsNone(file_cache.get('key'))
+
+    def test_ttl(self):
+        file_cache = self.cache.FileCache(self.directory, ttl=60)
+        file_cache.set('key', 1)
+        path = file_cache._path('key')
+        os.utime(path, (0, 0))
+
+        self.assertIsNone(file_cache.get('key'))
+
+    def test_eviction(self):
+        file_cache = self.cache.FileCache(self.directory, max_entries=2)
+        for i in range(3):
+            file_cache.set(str(i), i)
+            os.utime(file_cache._path(str(i)), (i, i))
+        file_cache.set('3', 3)
+
+        self.assertIsNone(file_cache.get('0'))
+        self.assertIsNone(file_cache.get('1'))
+        self.assertEqual(2, file_cache.get('2'))
+        self.assertEqual(3, file_cache.get('3'))
@@ -13,10 +13,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
 from mock import patch, Mock
 
+# Modules that must not be imported just to parse the command line
+HEAVY_MODULES = ['maas.client', 'pynetbox', 'requests', 'aiohttp']
+
+# Generous wall time budget for `maas2netbox --help`, in seconds
+STARTUP_BUDGET = 1.0
+
 
 class CliTesting(unittest.TestCase):
 
@@ -43,6 +54,9 @@ class CliTesting(unittest.TestCase):
 
         args = Mock()
         args.field = 'serialnumber'
+        args.plan = None
+        args.incremental = False
+        args.store = None
         result = self.m2n_cli.run_validation(args)
 
         self.assertEqual(check_result, result)
@@ -64,7 +78,206 @@ class CliTesting(unittest.TestCase):
 
         args = Mock()
         args.field = 'serialnumber'
+        args.plan = None
+        args.incremental = False
+        args.store = None
         result = self.m2n_cli.run_updates(args)
 
         mock_updaters.SerialNumberUpdater.assert_called_once_with(check_result)
         self.assertEqual(update_result, result)
+
+    @patch('maas2netbox.cli.snapshot')
+    @patch('maas2netbox.cli.validators')
+    def test_run_validation_all(self, mock_validators, mock_snapshot):
+        args = Mock()
+        args.field = 'all'
+        args.plan = None
+        args.incremental = False
+        args.store = None
+        args.workers = 1
+        result = self.m2n_cli.run_validation(args)
+
+        self.assertEqual(self.m2n_cli.ALL_FIELDS, list(result.keys()))
+        mock_snapshot.Snapshot.assert_called_once_with(tracker=None)
+        mock_validators.SerialNumberValidator.assert_called_once_with(
+            use_maas=True, snapshot=mock_snapshot.Snapshot.return_value)
+        mock_validators.SwitchConnectionsValidator.assert_called_once_with(
+            use_maas=True, snapshot=mock_snapshot.Snapshot.return_value)
+        mock_validators.ExperimentalValidator.assert_not_called()
+
+    @patch('maas2netbox.cli.snapshot')
+    @patch('maas2netbox.cli.validators')
+    def test_run_validation_all_workers(self, mock_validators, mock_snapshot):
+        status_validator = Mock()
+        mock_validators.StatusValidator.return_value = status_validator
+        check_result = Mock()
+        status_validator.check_nodes.return_value = check_result
+
+        args = Mock()
+        args.field = 'all'
+        args.plan = None
+        args.incremental = False
+        args.store = None
+        args.workers = 4
+        result = self.m2n_cli.run_validation(args)
+
+        self.assertEqual(check_result, result['status'])
+
+    @patch('maas2netbox.cli.snapshot')
+    @patch('maas2netbox.cli.updaters')
+    @patch('maas2netbox.cli.validators')
+    def test_run_updates_all(self, mock_validators, mock_updaters,
+                             mock_snapshot):
+        args = Mock()
+        args.field = 'all'
+        args.plan = None
+        args.incremental = False
+        args.store = None
+        args.workers = 1
+        result = self.m2n_cli.run_updates(args)
+
+        self.assertNotIn('switch_connections', result)
+        platform_errors = \
+            mock_validators.PlatformValidator.return_value.check_nodes()
+        mock_updaters.PlatformUpdater.assert_called_once_with(platform_errors)
+
+    @patch('maas2netbox.cli.plan')
+    @patch('maas2netbox.cli.validators')
+    def test_run_validation_writes_plan(self, mock_validators, mock_plan):
+        check_result = \
+            mock_validators.StatusValidator.return_value.check_nodes()
+
+        args = Mock()
+        args.field = 'status'
+        args.plan = 'plan.json'
+        args.store = None
+        self.m2n_cli.run_validation(args)
+
+        mock_plan.write_plan.assert_called_once_with(
+            'plan.json', {'status': check_result})
+
+    @patch('maas2netbox.cli.netbox')
+    @patch('maas2netbox.cli.plan')
+    @patch('maas2netbox.cli.updaters')
+    @patch('maas2netbox.cli.validators')
+    def test_run_updates_from_plan(self, mock_validators, mock_updaters,
+                                   mock_plan, mock_netbox):
+        changes = {'status': {1: {'expected': 'Active'}}}
+        mock_plan.drop_stale_changes.return_value = changes
+
+        args = Mock()
+        args.field = 'all'
+        args.plan = 'plan.json'
+        args.store = None
+        self.m2n_cli.run_updates(args)
+
+        mock_plan.drop_stale_changes.assert_called_once_with(
+            mock_plan.read_plan.return_value,
+            mock_netbox.get_netbox_api.return_value)
+        mock_validators.StatusValidator.assert_not_called()
+        mock_updaters.StatusUpdater.assert_called_once_with(
+            changes['status'])
+        mock_updaters.SerialNumberUpdater.assert_not_called()
+
+    @patch('maas2netbox.cli.snapshot')
+    @patch('maas2netbox.cli.updaters')
+    @patch('maas2netbox.cli.validators')
+    def test_incremental_validate_then_update(self, mock_validators,
+                                              mock_updaters, mock_snapshot):
+        from maas2netbox import sync
+        machine = Mock(system_id='abc', hostname='node1', osystem='ubuntu',
+                       distro_series='bionic', _data={})
+        machine.status.name = 'DEPLOYED'
+        errors = {1: {'current': 'Offline', 'expected': 'Active'}}
+
+        def check_nodes():
+            tracker = mock_snapshot.Snapshot.call_args[1]['tracker']
+            return errors if tracker.changed([machine]) else {}
+
+        mock_validators.StatusValidator.return_value.check_nodes = \
+            check_nodes
+        mock_config = Mock(maas_sweep_interval=3600)
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(sync, 'config', mock_config), \
+                patch.object(sync.cache, 'get_cache',
+                             return_value=sync.cache.FileCache(directory)):
+            for command in ['validate', 'update']:
+                with patch.object(sys, 'argv', [
+                        'maas2netbox', '-c', command, '-f', 'status',
+                        '--incremental']):
+                    self.m2n_cli.main()
+
+        mock_updaters.StatusUpdater.assert_called_once_with(errors)
+
+    def run_main(self, *argv):
+        with patch.object(sys, 'argv', ['maas2netbox'] + list(argv)), \
+                patch.object(sys, 'stderr'):
+            self.m2n_cli.main()
+
+    def test_incremental_rejected(self):
+        for argv in (['-c', 'create', '-f', 'experimental'],
+                     ['-c', 'serve', '-f', 'all'],
+                     ['-c', 'snapshot', '-f', 'all', '--store', 'x.db'],
+                     ['-c', 'update', '-f', 'all', '--plan', 'plan.json']):
+            with self.assertRaises(SystemExit) as context:
+                self.run_main(*(argv + ['--incremental']))
+            self.assertEqual(2, context.exception.code)
+
+    @patch('maas2netbox.cli.store')
+    def test_validate_store_checks(self, mock_store):
+        snapshot_store = mock_store.SnapshotStore.return_value
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshots.db')
+            with self.assertRaises(SystemExit):
+                self.run_main('-c', 'validate', '-f', 'status',
+                              '--store', path)
+            mock_store.SnapshotStore.assert_not_called()
+
+            open(path, 'w').close()
+            snapshot_store.latest_id.side_effect = LookupError
+            with self.assertRaises(SystemExit):
+                self.run_main('-c', 'validate', '-f', 'status',
+                              '--store', path)
+
+            snapshot_store.has_snapshot.return_value = False
+            with self.assertRaises(SystemExit):
+                self.run_main('-c', 'validate', '-f', 'status',
+                              '--store', path, '--snapshot-id', '0')
+            snapshot_store.has_snapshot.assert_called_once_with(0)
+            self.assertEqual(2, snapshot_store.close.call_count)
+
+    @patch('maas2netbox.cli.store')
+    @patch('maas2netbox.cli.validators')
+    def test_run_validation_closes_store(self, mock_validators, mock_store):
+        args = Mock()
+        args.field = 'status'
+        args.plan = None
+        args.store = 'snapshots.db'
+        args.snapshot_id = None
+        self.m2n_cli.run_validation(args)
+
+        mock_store.StoredSnapshot.assert_called_once_with(
+            mock_store.SnapshotStore.return_value, None)
+        mock_store.SnapshotStore.return_value.close.assert_called_once_with()
+
+
+class CliStartupTesting(unittest.TestCase):
+
+    def test_import_is_lightweight(self):
+        code = (
+            'import sys; from maas2netbox import cli; '
+            'print(",".join(m for m in {} if m in sys.modules))'
+            .format(HEAVY_MODULES))
+        output = subprocess.check_output([sys.executable, '-c', code])
+
+        self.assertEqual(b'', output.strip())
+
+    def test_help_startup_time(self):
+        command = [sys.executable, '-m', 'maas2netbox.cli', '--help']
+        durations = []
+        for _ in range(3):
+            start = time.monotonic()
+            subprocess.check_output(command)
+            durations.append(time.monotonic() - start)
+
+        self.assertLess(min(durations), STARTUP_BUDGET)
@@ -0,0 +1,144 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+
+from mock import patch, Mock
+
+STEPS = ['create_interfaces', 'update_physical_interfaces',
+         'patch_parent_interfaces', 'create_ip_addresses',
+         'create_switch_connections']
+
+
+class VirtualInterfacesCreatorTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox import creators
+        self.creators = creators
+        self.creator = creators.VirtualInterfacesCreator(None, Mock())
+        self.creator._maas_nodes = [
+            Mock(hostname='node{}'.format(i)) for i in range(1, 5)]
+        self.creator._netbox_nodes = {'node1': 1, 'node2': 2, 'node3': 3}
+        self.creator.prefetch = Mock()
+        self.creator.get_node_interfaces = Mock(return_value=[])
+        self.creator.get_switch_connection_details = Mock(return_value=[])
+        self.creator.get_netbox_node_ifaces_dict = Mock(return_value={})
+
+        self.calls = []
+        self.lock = threading.Lock()
+        for step in STEPS:
+            setattr(self.creator, step, self.get_step(step))
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def get_step(self, step):
+        def run_step(*args):
+            netbox_node = args[1] if step in (
+                'create_interfaces', 'create_ip_addresses') else None
+            if step == 'create_ip_addresses' and netbox_node == 2:
+                raise Exception('NetBox is down')
+            with self.lock:
+                self.calls.append((step, netbox_node))
+        return run_step
+
+    def get_steps(self, netbox_node):
+        steps = []
+        for step, node in self.calls:
+            if step == 'create_interfaces':
+                current = node
+            if current == netbox_node:
+                steps.append(step)
+        return steps
+
+    def test_maas_nodes(self):
+        from maas.client import enum
+        deployed = Mock(status=enum.NodeStatus.DEPLOYED)
+        machines = [deployed, Mock(status=enum.NodeStatus.NEW)]
+        self.creator._maas_nodes = None
+
+        with patch.object(self.creators.maas, 'get_nodes',
+                          return_value=machines):
+            self.assertEqual([deployed], self.creator.maas_nodes)
+
+    def test_nodes_are_memoized(self):
+        from maas2netbox.utils.netbox import Item
+        netbox_api = Mock()
+        netbox_api.get_nodes.return_value = [Item({
+            'id': 1, 'name': 'NODE1', 'serial': None, 'status': None,
+            'primary_ip4': None, 'platform': None, 'comments': ''})]
+        creator = self.creators.VirtualInterfacesCreator(
+            None, self.creators.Snapshot(netbox_api))
+
+        with patch.object(self.creators.maas, 'get_nodes',
+                          return_value=[]) as mock_get_nodes:
+            for _ in range(2):
+                self.assertEqual({'node1': 1}, creator.netbox_nodes)
+                self.assertEqual([], creator.maas_nodes)
+            self.assertEqual(1, netbox_api.get_nodes.call_count)
+            self.assertEqual(1, mock_get_nodes.call_count)
+
+            creator.refresh()
+            creator.netbox_nodes
+            creator.maas_nodes
+            self.assertEqual(2, netbox_api.get_nodes.call_count)
+            self.assertEqual(2, mock_get_nodes.call_count)
+
+    def test_create(self):
+        failed = self.creator.create()
+
+        self.creator.prefetch.assert_called_once_with()
+        self.assertEqual({'node2': 'NetBox is down'}, failed)
+        self.assertEqual(STEPS, self.get_steps(1))
+        self.assertEqual(STEPS[:3], self.get_steps(2))
+        self.assertEqual(STEPS, self.get_steps(3))
+        self.assertNotIn(4, [node for _, node in self.calls])
+
+    def test_create_with_workers(self):
+        nodes = {}
+
+        def update_node(hostname, netbox_node, *args):
+            with self.lock:
+                nodes[hostname] = threading.current_thread()
+            if netbox_node == 2:
+                raise Exception('NetBox is down')
+
+        self.creator.update_node = update_node
+        failed = self.creator.create(workers=2)
+
+        self.assertEqual({'node2': 'NetBox is down'}, failed)
+        self.assertEqual(['node1', 'node2', 'node3'], sorted(nodes))
+        self.assertNotIn(threading.main_thread(), nodes.values())
+        self.assertEqual(3, self.creator.get_node_interfaces.call_count)
+
+    def test_prefetch_ip_addresses(self):
+        node_ifaces = [
+            self.creators.NodeInterface(
+                'bond0', 'bond', True, None, 9000, 0, [], '10.0.0.1/24'),
+            self.creators.NodeInterface(
+                'eno1', 'physical', True, None, 9000, None, ['bond0'], None)]
+        self.creator.get_node_interfaces.return_value = node_ifaces
+        netbox_api = self.creator.netbox_api
+
+        self.creator.create(workers=2)
+
+        netbox_api.has_ip_address.assert_called_once_with('10.0.0.1/24')
@@ -0,0 +1,153 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import unittest
+from http.client import HTTPConnection
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from mock import patch, Mock
+
+FIELDS = ['serialnumber', 'status']
+
+
+class ReconcilerTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox import daemon
+        self.daemon = daemon
+        self.snapshot = Mock()
+        self.get_validator = Mock()
+        self.get_validator.return_value.check_nodes.return_value = {
+            1: {'current': None, 'expected': 'ABC123'}}
+        self.reconciler = daemon.Reconciler(
+            self.get_validator, FIELDS, self.snapshot)
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def test_take_jobs(self):
+        self.reconciler.submit('status')
+        self.reconciler.submit('experimental')
+        self.reconciler.submit('all')
+
+        self.assertEqual(
+            ['serialnumber', 'status', 'experimental'],
+            self.reconciler.take_jobs(0))
+        self.assertEqual([], self.reconciler.take_jobs(0))
+
+    def test_reconcile_keeps_hardware(self):
+        self.get_validator.return_value.check_nodes.side_effect = [
+            {}, Exception('NetBox is down')]
+
+        self.reconciler.reconcile(FIELDS)
+
+        self.snapshot.refresh.assert_called_once_with(keep_hardware=True)
+        self.snapshot.netbox_api.refresh.assert_called_once_with()
+        self.get_validator.assert_any_call('status', self.snapshot)
+        self.assertEqual({}, self.reconciler.get_results('serialnumber')[
+            'errors'])
+        self.assertIsNone(self.reconciler.get_results('status'))
+
+
+class ServerTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox import daemon
+        self.reconciler = Mock()
+        self.server = daemon.start_server(
+            self.reconciler, FIELDS + ['all'], '127.0.0.1', 0, 'secret')
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.module_patcher.stop()
+
+    def request(self, path, method='GET', token='secret'):
+        request = Request(self.url + path, method=method, data=(
+            b'{}' if method == 'POST' else None))
+        request.add_header('Authorization', 'Token {}'.format(token))
+        try:
+            with urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_validate(self):
+        status, data = self.request('/validate/status', 'POST')
+
+        self.assertEqual(202, status)
+        self.reconciler.submit.assert_called_once_with('status')
+
+    def test_webhook(self):
+        status, _ = self.request('/webhook', 'POST')
+
+        self.assertEqual(202, status)
+        self.reconciler.submit.assert_called_once_with('all')
+
+    def test_unknown_field(self):
+        status, _ = self.request('/validate/unknown', 'POST')
+
+        self.assertEqual(404, status)
+        self.reconciler.submit.assert_not_called()
+
+    def test_token(self):
+        status, _ = self.request('/webhook', 'POST', token='wrong')
+
+        self.assertEqual(403, status)
+        self.reconciler.submit.assert_not_called()
+
+    def test_results(self):
+        self.reconciler.get_results.return_value = {
+            'finished': 1, 'errors': {1: {'expected': 'ABC123'}}}
+
+        status, data = self.request('/results/serialnumber')
+
+        self.assertEqual(200, status)
+        self.assertEqual({'1': {'expected': 'ABC123'}}, data['errors'])
+        self.reconciler.get_results.assert_called_once_with('serialnumber')
+
+    def test_results_token(self):
+        status, _ = self.request('/results', token='wrong')
+
+        self.assertEqual(403, status)
+        self.reconciler.get_results.assert_not_called()
+        self.assertEqual(200, self.request('/health', token='wrong')[0])
+
+    def test_invalid_content_length(self):
+        connection = HTTPConnection('127.0.0.1', self.server.server_port,
+                                    timeout=5)
+        connection.putrequest('POST', '/webhook')
+        connection.putheader('Authorization', 'Token secret')
+        connection.putheader('Content-Length', 'many')
+        connection.endheaders()
+
+        self.assertEqual(400, connection.getresponse().status)
+        connection.close()
+        self.reconciler.submit.assert_not_called()
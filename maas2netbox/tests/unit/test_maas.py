@@ -0,0 +1,138 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tempfile
+import unittest
+
+from mock import patch, Mock
+
+LSHW = b"""<list><node class="system">
+<serial>ABC123</serial>
+<node class="bus"><node class="bridge"><node class="bridge">
+<node class="network">
+<logicalname>eno1</logicalname>
+<serial>aa:bb:cc:dd:ee:ff</serial>
+<configuration><setting id="driver" value="ixgbe" /></configuration>
+</node>
+</node></node></node>
+</node></list>"""
+
+LLDP = b"""<lldp><interface name="eno1">
+<chassis><name>switch1</name></chassis>
+<port><id>Ethernet1</id><descr>uplink (port: blue)</descr></port>
+<vlan vlan-id="100" />
+</interface></lldp>"""
+
+
+class MaaSTesting(unittest.TestCase):
+
+    def setUp(self):
+        mock_config = Mock()
+        mock_config.CABLE_COLORS = {'blue': '2196f3'}
+        mock_config.cache_dir = None
+        self.mock_config = mock_config
+        modules = {
+            'maas2netbox.config': mock_config,
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox.utils import maas
+        self.maas = maas
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def test_get_node_hardware(self):
+        node = Mock()
+        node.get_details.return_value = {'lshw': LSHW, 'lldp': LLDP}
+
+        hardware = self.maas.get_node_hardware(node)
+
+        node.get_details.assert_called_once_with()
+        self.assertEqual('ABC123', hardware.serial)
+        self.assertEqual(
+            [{'name': 'eno1', 'mac_address': 'AA:BB:CC:DD:EE:FF',
+              'type': '1150'}],
+            hardware.interfaces)
+        self.assertEqual(
+            [{'name': 'eno1', 'switch_name': 'switch1',
+              'switch_port': 'Ethernet1', 'vid': '100',
+              'cable_color': '2196f3'}],
+            hardware.switch_connections)
+
+    def test_get_node_hardware_without_details(self):
+        node = Mock()
+        node.get_details.return_value = {'lshw': b'<broken'}
+
+        hardware = self.maas.get_node_hardware(node)
+
+        self.assertIsNone(hardware.serial)
+        self.assertEqual([], hardware.interfaces)
+        self.assertEqual([], hardware.switch_connections)
+
+    def test_get_nodes_hardware(self):
+        node = Mock(system_id='abc')
+        node.get_details.return_value = {'lshw': LSHW}
+        failing_node = Mock(system_id='def')
+        failing_node.get_details.side_effect = ValueError()
+
+        result = self.maas.get_nodes_hardware(
+            [node, failing_node], concurrency=1)
+
+        self.assertEqual(['abc'], list(result.keys()))
+        self.assertEqual('ABC123', result['abc'].serial)
+
+    def test_get_nodes_hardware_cached(self):
+        self.mock_config.cache_dir = tempfile.mkdtemp()
+        self.mock_config.maas_cache_size = 10
+        node = Mock(system_id='abc')
+        node._data = {'current_commissioning_result_id': 1}
+        node.get_details.return_value = {'lshw': LSHW}
+        self.maas.get_nodes_hardware([node], concurrency=1)
+
+        result = self.maas.get_nodes_hardware([node], concurrency=1)
+
+        node.get_details.assert_called_once_with()
+        self.assertEqual('ABC123', result['abc'].serial)
+
+        # Recommissioning invalidates the cached details
+        node._data = {'current_commissioning_result_id': 2}
+        self.maas.get_nodes_hardware([node], concurrency=1)
+        self.assertEqual(2, node.get_details.call_count)
+
+    @patch('maas2netbox.utils.maas.helpers')
+    @patch('maas2netbox.utils.maas.requests')
+    def test_get_profile_cached_description(self, mock_requests,
+                                            mock_helpers):
+        self.mock_config.cache_dir = tempfile.mkdtemp()
+        self.mock_config.maas_url = 'http://maas:5240/MAAS/'
+        self.mock_config.maas_api_key = 'a:b:c'
+        mock_requests.get.return_value.json.return_value = {
+            'version': '2.6.0', 'subversion': '1'}
+        mock_helpers.connect.return_value.description = {'resources': []}
+
+        self.maas.get_profile()
+        profile = self.maas.get_profile()
+
+        mock_helpers.connect.assert_called_once()
+        self.assertEqual({'resources': []}, profile.description)
+        self.assertEqual('http://maas:5240/MAAS/api/2.0/', profile.url)
+
+        # A new server version fetches the description again
+        mock_requests.get.return_value.json.return_value = {
+            'version': '2.7.0', 'subversion': '1'}
+        self.maas.get_profile()
+        self.assertEqual(2, mock_helpers.connect.call_count)
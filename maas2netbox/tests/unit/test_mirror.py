@@ -0,0 +1,128 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tempfile
+import unittest
+
+from mock import patch, Mock
+
+
+class FakeNetBoxAPI(object):
+    """Serves listings from a dict of objects, recording the filters"""
+
+    def __init__(self, Item, objects):
+        self.Item = Item
+        self.objects = objects
+        self.requests = []
+
+    def select(self, filters):
+        objects = self.objects.values()
+        if 'device_id' in filters:
+            objects = [o for o in objects
+                       if o['device']['id'] in filters['device_id']]
+        if 'last_updated__gte' in filters:
+            objects = [o for o in objects
+                       if o['last_updated'] >= filters['last_updated__gte']]
+        return objects
+
+    def filter(self, endpoint, **filters):
+        self.requests.append(('filter', filters))
+        return [self.Item(values) for values in self.select(filters)]
+
+    def count(self, endpoint, **filters):
+        self.requests.append(('count', filters))
+        return len(self.select(filters))
+
+
+def get_interface(iface_id, device_id, last_updated):
+    return {'id': iface_id, 'name': 'eno{}'.format(iface_id),
+            'device': {'id': device_id}, 'last_updated': last_updated}
+
+
+class NetBoxMirrorTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox.utils import cache, mirror
+        from maas2netbox.utils.netbox import Item
+        self.mirror = mirror
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_cache = cache.FileCache(self.directory.name)
+        self.netbox_api = FakeNetBoxAPI(Item, {
+            1: get_interface(1, 10, '2019-06-01T10:00:00Z'),
+            2: get_interface(2, 10, '2019-06-01T11:00:00Z'),
+            3: get_interface(3, 20, '2019-06-01T11:00:00Z'),
+        })
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.module_patcher.stop()
+
+    def load(self, parent_ids=(10, 20), sweep_interval=3600):
+        self.netbox_api.requests = []
+        netbox_mirror = self.mirror.NetBoxMirror(
+            self.netbox_api, self.file_cache, 'mirror', sweep_interval)
+        scope = self.mirror.Scope(
+            'device_id', parent_ids, lambda values: values['device']['id'])
+        return netbox_mirror.load('interfaces', Mock(), scope=scope)
+
+    def test_full_load(self):
+        self.assertEqual([1, 2, 3], sorted(self.load()))
+        self.assertEqual(
+            [('filter', {'device_id': [10, 20]})], self.netbox_api.requests)
+
+    def test_delta_load(self):
+        self.load()
+        self.netbox_api.objects[1]['last_updated'] = '2019-06-01T12:00:00Z'
+        self.netbox_api.objects[1]['name'] = 'bond0'
+
+        objects = self.load()
+
+        self.assertEqual('bond0', objects[1]['name'])
+        self.assertEqual(
+            [('filter', {'last_updated__gte': '2019-06-01T11:00:00Z'}),
+             ('count', {'device_id': [10, 20]})],
+            self.netbox_api.requests)
+
+    def test_deletions(self):
+        self.load()
+        del self.netbox_api.objects[2]
+
+        objects = self.load()
+
+        self.assertEqual([1, 3], sorted(objects))
+        self.assertIn(
+            ('filter', {'device_id': [10, 20], 'brief': 1}),
+            self.netbox_api.requests)
+
+    def test_scope_changes(self):
+        self.load(parent_ids=[10])
+        objects = self.load(parent_ids=[20])
+
+        self.assertEqual([3], sorted(objects))
+        self.assertIn(
+            ('filter', {'device_id': [20]}), self.netbox_api.requests)
+
+    def test_sweep(self):
+        self.load()
+        self.load(sweep_interval=-1)
+
+        self.assertEqual(
+            [('filter', {'device_id': [10, 20]})], self.netbox_api.requests)
@@ -0,0 +1,318 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tempfile
+import threading
+import unittest
+
+import pynetbox
+from mock import call, patch, Mock
+
+
+class NetBoxAPITesting(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_config = Mock()
+        self.mock_config.cache_dir = None
+        self.mock_config.netbox_mirror = False
+        modules = {
+            'maas2netbox.config': self.mock_config,
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox.utils import netbox
+        self.netbox = netbox
+
+        self.api_patcher = patch('maas2netbox.utils.netbox.pynetbox')
+        self.mock_pynetbox = self.api_patcher.start()
+        self.mock_pynetbox.RequestError = pynetbox.RequestError
+        self.mock_api = self.mock_pynetbox.api.return_value
+        self.mock_session = Mock()
+        self.netbox_api = self.netbox.NetBoxAPI(self.mock_session)
+        self.netbox_api.load_record = Mock(
+            side_effect=lambda endpoint, values: values)
+
+    def tearDown(self):
+        self.api_patcher.stop()
+        self.module_patcher.stop()
+
+    def mock_listings(self, listings):
+        self.netbox_api.filter = Mock(
+            side_effect=lambda endpoint, **filters: listings[endpoint])
+
+    def test_chunks(self):
+        result = list(self.netbox.chunks(range(5), 2))
+
+        self.assertEqual([[0, 1], [2, 3], [4]], result)
+
+    def test_filter(self):
+        self.mock_config.netbox_page_size = 2
+        self.mock_config.netbox_page_workers = 2
+        pages = {
+            0: {'count': 5, 'results': [1, 2], 'next': 'next'},
+            2: {'count': 5, 'results': [3, 4], 'next': 'next'},
+            4: {'count': 5, 'results': [5], 'next': None},
+        }
+        self.netbox_api.request = Mock(
+            side_effect=lambda method, url, params: pages[params['offset']])
+
+        result = self.netbox_api.filter(
+            self.mock_api.dcim.devices, site='site')
+
+        self.assertEqual([1, 2, 3, 4, 5], result)
+        self.netbox_api.request.assert_any_call(
+            'get', '{}/'.format(self.mock_api.dcim.devices.url),
+            params={'site': 'site', 'offset': 4, 'limit': 2})
+
+    def test_filter_capped_page_size(self):
+        self.mock_config.netbox_page_size = 1000
+        self.mock_config.netbox_page_workers = 4
+        pages = {
+            0: {'count': 3, 'results': [1, 2], 'next': 'next'},
+            2: {'count': 3, 'results': [3], 'next': None},
+        }
+        self.netbox_api.request = Mock(
+            side_effect=lambda method, url, params: pages[params['offset']])
+
+        result = self.netbox_api.filter(self.mock_api.dcim.devices)
+
+        self.assertEqual([1, 2, 3], result)
+        self.assertEqual(
+            2, self.netbox_api.request.call_args[1]['params']['limit'])
+
+    def test_get_nodes_interfaces(self):
+        self.netbox_api.filter = Mock(side_effect=[[1, 2], [3]])
+        node_ids = list(range(self.netbox.FILTER_CHUNK_SIZE + 1))
+
+        result = self.netbox_api.get_nodes_interfaces(node_ids)
+
+        self.assertEqual([1, 2, 3], result)
+        self.netbox_api.filter.assert_called_with(
+            self.mock_api.dcim.interfaces,
+            device_id=[self.netbox.FILTER_CHUNK_SIZE])
+
+    def test_get_nodes_interfaces_mirror(self):
+        interfaces = {
+            1: {'id': 1, 'name': 'eno1', 'device': {'id': 10}},
+            2: {'id': 2, 'name': 'eno2', 'device': {'id': 10}},
+        }
+        self.netbox_api._mirror = Mock()
+        self.netbox_api._mirror.lock = threading.RLock()
+        self.netbox_api._mirror.load.side_effect = \
+            lambda name, *args, **kwargs: {
+                'devices': {10: {'id': 10}},
+                'interfaces': interfaces}[name]
+        self.netbox_api.filter = Mock(return_value=['switch-port'])
+
+        result = self.netbox_api.get_nodes_interfaces([10, 99])
+
+        self.assertEqual(
+            ['eno1', 'eno2', 'switch-port'],
+            [getattr(iface, 'name', iface) for iface in result])
+        self.netbox_api.filter.assert_called_once_with(
+            self.mock_api.dcim.interfaces, device_id=[99])
+        self.assertEqual(
+            ['eno2'], [iface.name for iface in
+                       self.netbox_api.get_node_interfaces(10, 'eno2')])
+
+    @staticmethod
+    def get_cable(termination_a_id, termination_b_id):
+        cable = Mock()
+        cable.termination_a_type = 'dcim.interface'
+        cable.termination_b_type = 'dcim.interface'
+        cable.termination_a_id = termination_a_id
+        cable.termination_b_id = termination_b_id
+        return cable
+
+    def test_get_cable(self):
+        cable = self.get_cable(1, 2)
+        self.mock_listings({self.mock_api.dcim.cables: [cable]})
+
+        self.assertEqual(cable, self.netbox_api.get_cable(1, 2))
+        self.assertEqual(cable, self.netbox_api.get_cable(2, 1))
+        self.assertIsNone(self.netbox_api.get_cable(1, 3))
+        self.netbox_api.filter.assert_called_once()
+
+    def test_create_cable_updates_index(self):
+        self.mock_listings({self.mock_api.dcim.cables: []})
+        self.assertIsNone(self.netbox_api.get_cable(1, 2))
+        cable = self.get_cable(1, 2)
+        self.netbox_api.request = Mock(return_value=cable)
+
+        self.netbox_api.create_cable({})
+
+        self.assertEqual(cable, self.netbox_api.get_cable(1, 2))
+
+    def mock_reference_data(self):
+        self.netbox_api.get_choices = Mock(return_value={
+            'device:status': [{'label': 'Active', 'value': 1}],
+            'interface:type': [
+                {'label': 'Virtual', 'value': [
+                    {'label': 'LAG', 'value': 200}]}],
+        })
+        platform = Mock(slug='ubuntu-bionic', id=3)
+        self.mock_listings({
+            self.mock_api.dcim.platforms: [platform],
+            self.mock_api.ipam.vlans: [Mock(vid=100, id=7)],
+        })
+
+    def test_reference_data(self):
+        self.mock_reference_data()
+
+        self.assertEqual(1, self.netbox_api.get_status_value('Active'))
+        self.assertEqual(200, self.netbox_api.get_interface_type_value('LAG'))
+        self.assertEqual(3, self.netbox_api.get_platform_id('ubuntu-bionic'))
+        self.assertEqual(7, self.netbox_api.get_vlan_id('100'))
+        self.assertEqual(7, self.netbox_api.get_vlan_id(100))
+        self.assertIsNone(self.netbox_api.get_platform_id('centos-7'))
+        self.netbox_api.get_choices.assert_called_once_with()
+
+    def test_reference_data_disk_cache(self):
+        self.mock_config.cache_dir = tempfile.mkdtemp()
+        self.mock_config.netbox_cache_ttl = 60
+        self.mock_reference_data()
+        self.netbox_api.get_status_value('Active')
+
+        netbox_api = self.netbox.NetBoxAPI(self.mock_session)
+        netbox_api.get_choices = self.netbox_api.get_choices
+        netbox_api.filter = self.netbox_api.filter
+        self.assertEqual(3, netbox_api.get_platform_id('ubuntu-bionic'))
+        self.netbox_api.get_choices.assert_called_once_with()
+
+        # A miss on cached data reloads it from NetBox
+        self.assertIsNone(netbox_api.get_platform_id('centos-7'))
+        self.assertEqual(2, self.netbox_api.get_choices.call_count)
+
+    def test_patch_nodes(self):
+        self.mock_config.netbox_bulk_size = 2
+        updates = [{'id': i, 'serial': str(i)} for i in range(3)]
+
+        self.netbox_api.patch_nodes(updates)
+
+        self.assertEqual(2, self.mock_session.request.call_count)
+        method, url = self.mock_session.request.call_args[0]
+        self.assertEqual('patch', method)
+        self.assertEqual(
+            '{}/'.format(self.mock_api.dcim.devices.url), url)
+
+    def test_patch_nodes_without_bulk_support(self):
+        self.mock_config.netbox_bulk_size = 2
+        not_allowed = Mock(ok=False, status_code=405)
+        self.mock_session.request.side_effect = [not_allowed, Mock(), Mock()]
+        updates = [{'id': i, 'serial': str(i)} for i in range(2)]
+
+        self.netbox_api.patch_nodes(updates)
+
+        method, url = self.mock_session.request.call_args[0]
+        self.assertEqual(
+            '{}/1/'.format(self.mock_api.dcim.devices.url), url)
+        self.assertEqual(
+            '{"serial": "1"}',
+            self.mock_session.request.call_args[1]['data'])
+
+    def test_create_cables(self):
+        self.mock_config.netbox_bulk_size = 1
+        self.mock_listings({self.mock_api.dcim.cables: []})
+        self.assertIsNone(self.netbox_api.get_cable(1, 2))
+        cables = [self.get_cable(1, 2), self.get_cable(3, 4)]
+        self.netbox_api.request = Mock(side_effect=[[cables[0]], [cables[1]]])
+
+        result = self.netbox_api.create_cables([{}, {}])
+
+        self.assertEqual([cables[0].id, cables[1].id], result)
+        self.assertEqual(cables[1], self.netbox_api.get_cable(4, 3))
+
+    def test_has_ip_address(self):
+        self.mock_listings({
+            self.mock_api.ipam.ip_addresses: [Mock(address='10.0.0.1/24')]})
+
+        self.assertTrue(self.netbox_api.has_ip_address('10.0.0.1/24'))
+        self.assertFalse(self.netbox_api.has_ip_address('10.0.0.2/24'))
+        self.netbox_api.filter.assert_called_once_with(
+            self.mock_api.ipam.ip_addresses, parent='10.0.0.0/24', brief=1)
+
+        self.netbox_api.request = Mock(
+            return_value=Mock(address='10.0.0.2/24'))
+        self.netbox_api.create_ip_address({})
+        self.assertTrue(self.netbox_api.has_ip_address('10.0.0.2/24'))
+
+    def test_switch_ports(self):
+        switch = Mock(id=1)
+        switch.name = 'Switch1'
+        port = Mock(device=switch)
+        port.name = 'Ethernet1'
+        self.mock_listings({
+            self.mock_api.dcim.devices: [switch],
+            self.mock_api.dcim.interfaces: [port],
+        })
+
+        self.netbox_api.load_switch_ports(['switch1', 'Switch1', 'switch2'])
+
+        self.assertEqual(switch, self.netbox_api.get_switch('switch1'))
+        self.assertIsNone(self.netbox_api.get_switch('switch2'))
+        self.assertEqual(
+            port, self.netbox_api.get_switch_port('Switch1', 'Ethernet1'))
+        self.assertIsNone(
+            self.netbox_api.get_switch_port('Switch1', 'Ethernet2'))
+        self.assertEqual([
+            call(self.mock_api.dcim.devices,
+                 name=['Switch1', 'switch1', 'switch2'], brief=1),
+            call(self.mock_api.dcim.interfaces, device_id=[1], brief=1),
+        ], self.netbox_api.filter.call_args_list)
+
+    def test_iter_pages(self):
+        self.mock_config.netbox_page_size = 2
+        self.mock_config.netbox_page_workers = 1
+        self.netbox_api.request = Mock(side_effect=[
+            {'count': 3, 'results': [1, 2], 'next': 'next'},
+            {'count': 3, 'results': [3], 'next': None},
+        ])
+
+        pages = self.netbox_api.iter_pages(
+            self.mock_api.dcim.devices, site='site')
+
+        self.assertEqual([1, 2], next(pages))
+        self.assertEqual([3], next(pages))
+        self.assertRaises(StopIteration, next, pages)
+
+
+class ItemTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox.utils import netbox
+        self.netbox = netbox
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def test_attributes(self):
+        item = self.netbox.Item({
+            'id': 1, 'name': 'node1',
+            'status': {'value': 1, 'label': 'Active'},
+            'tagged_vlans': [{'id': 2}], 'platform': None})
+
+        self.assertEqual(1, item.id)
+        self.assertEqual('Active', item.status.label)
+        self.assertEqual(2, item.tagged_vlans[0].id)
+        self.assertIsNone(item.platform)
+        self.assertEqual('node1', repr(item))
+        self.assertRaises(AttributeError, getattr, item, 'serial')
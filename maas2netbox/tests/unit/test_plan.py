@@ -0,0 +1,118 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from mock import patch, Mock
+
+DEVICE = {
+    'id': 1, 'name': 'NODE1', 'serial': 'ABC123',
+    'status': {'value': 1, 'label': 'Active'},
+    'primary_ip4': None, 'platform': None, 'comments': ''}
+
+
+class PlanTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox import plan, records
+        from maas2netbox.utils.netbox import Item
+        self.plan = plan
+        self.records = records
+        self.Item = Item
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'plan.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.module_patcher.stop()
+
+    def test_write_and_read_plan(self):
+        changes = {
+            'serialnumber': {1: {'current': None, 'expected': 'ABC123',
+                                 'fingerprint': 'abc'}},
+            'switch_connections': None,
+        }
+        self.plan.write_plan(self.path, changes)
+
+        self.assertEqual(
+            {'serialnumber': changes['serialnumber']},
+            self.plan.read_plan(self.path))
+
+    def test_read_plan_version(self):
+        with open(self.path, 'w') as f:
+            f.write('{"version": 0, "fields": {}}')
+
+        with self.assertRaises(ValueError):
+            self.plan.read_plan(self.path)
+
+    def test_drop_stale_changes(self):
+        device = self.Item(DEVICE)
+        fingerprint = self.records.NetBoxNode.from_device(
+            device).fingerprint()
+        changes = {
+            'status': {1: {'expected': 'Active', 'fingerprint': fingerprint}},
+            'platform': {1: {'expected': 'ubuntu-bionic',
+                             'fingerprint': fingerprint},
+                         2: {'expected': 'ubuntu-bionic',
+                             'fingerprint': fingerprint}},
+        }
+        netbox_api = Mock()
+        netbox_api.get_nodes_by_id.return_value = [
+            device, self.Item(dict(DEVICE, id=2, serial='XYZ'))]
+
+        changes = self.plan.drop_stale_changes(changes, netbox_api)
+
+        netbox_api.get_nodes_by_id.assert_called_once_with({1, 2})
+        self.assertEqual([1], list(changes['status']))
+        self.assertEqual([1], list(changes['platform']))
+
+    def test_drop_changes_of_changed_interfaces(self):
+        device = self.Item(DEVICE)
+        eno1 = self.Item({'id': 11, 'device': {'id': 1}, 'name': 'eno1',
+                          'mac_address': 'AA:BB'})
+        eno2 = self.Item({'id': 12, 'device': {'id': 1}, 'name': 'eno2',
+                          'mac_address': 'CC:DD'})
+        node = self.records.NetBoxNode.from_device(device)
+        changes = {
+            'interfaces': {1: {
+                'expected': [{'name': 'eno2', 'mac_address': 'CC:DD'}],
+                'fingerprint': node.interfaces_fingerprint(
+                    [('eno1', 'AA:BB')])}},
+            'status': {1: {'expected': 'Active',
+                           'fingerprint': node.fingerprint()}},
+        }
+        netbox_api = Mock()
+        netbox_api.get_nodes_by_id.return_value = [device]
+
+        netbox_api.get_nodes_interfaces.return_value = [eno1]
+        self.assertEqual(
+            [1], list(self.plan.drop_stale_changes(
+                {field: dict(nodes) for field, nodes in changes.items()},
+                netbox_api)['interfaces']))
+        netbox_api.get_nodes_interfaces.assert_called_once_with([1])
+
+        netbox_api.get_nodes_interfaces.return_value = [eno1, eno2]
+        changes = self.plan.drop_stale_changes(changes, netbox_api)
+
+        self.assertEqual({}, changes['interfaces'])
+        self.assertEqual([1], list(changes['status']))
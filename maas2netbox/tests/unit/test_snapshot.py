@@ -0,0 +1,114 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from mock import patch, Mock
+
+
+def get_machine(system_id, hostname, status='DEPLOYED'):
+    machine = Mock(system_id=system_id, hostname=hostname,
+                   osystem='ubuntu', distro_series='bionic')
+    machine.status.name = status
+    bond = Mock()
+    bond.links = [Mock(ip_address='10.0.0.1')]
+    machine.interfaces.get_by_name.return_value = bond
+    return machine
+
+
+class SnapshotTesting(unittest.TestCase):
+
+    def setUp(self):
+        mock_config = Mock()
+        mock_config.cache_dir = None
+        modules = {
+            'maas2netbox.config': mock_config,
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox import records, snapshot
+        self.records = records
+        self.snapshot = snapshot
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def test_maas_nodes_are_records(self):
+        machine = get_machine('abc', 'node1')
+        with patch.object(self.snapshot.maas, 'get_nodes',
+                          return_value=[machine]):
+            nodes = self.snapshot.Snapshot(Mock()).maas_nodes
+
+        self.assertEqual(
+            [self.records.MaaSNode('abc', 'node1', 'DEPLOYED',
+                                   'ubuntu-bionic', '10.0.0.1')],
+            nodes)
+        self.assertFalse(hasattr(nodes[0], '__dict__'))
+
+    def test_load_maas_nodes_with_hardware(self):
+        machines = [get_machine('abc', 'node1'),
+                    get_machine('def', 'node2', status='NEW')]
+        hardware = Mock()
+        snapshot = self.snapshot.Snapshot(Mock())
+        with patch.object(self.snapshot.maas, 'get_nodes',
+                          return_value=machines) as mock_get_nodes, \
+                patch.object(self.snapshot.maas, 'get_nodes_hardware',
+                             return_value={'abc': hardware}) as mock_hw:
+            snapshot.load_maas_nodes()
+            nodes = snapshot.load_maas_nodes(hardware=True)
+            snapshot.load_maas_nodes()
+
+        self.assertEqual(2, mock_get_nodes.call_count)
+        mock_hw.assert_called_once_with([machines[0]])
+        self.assertEqual(hardware, nodes[0].hardware)
+        self.assertIsNone(nodes[1].hardware)
+
+    def test_netbox_pages_are_records(self):
+        from maas2netbox.utils.netbox import Item
+        device = Item({
+            'id': 1, 'name': 'NODE1', 'serial': 'ABC123',
+            'status': {'value': 1, 'label': 'Active'},
+            'primary_ip4': {'id': 5, 'address': '10.0.0.1/24'},
+            'platform': None, 'comments': ''})
+        netbox_api = Mock()
+        netbox_api.iter_nodes_pages.return_value = iter([[device]])
+
+        nodes = list(
+            self.snapshot.Snapshot(netbox_api).iter_netbox_nodes())
+
+        self.assertEqual(
+            [self.records.NetBoxNode(1, 'NODE1', 'ABC123', 'Active',
+                                     '10.0.0.1/24', None, '')],
+            nodes)
+
+    def test_refresh_keeps_hardware(self):
+        machine = get_machine('abc', 'node1')
+        machine._data = {'current_commissioning_result_id': 1}
+        snapshot = self.snapshot.Snapshot(Mock())
+        with patch.object(self.snapshot.maas, 'get_nodes_hardware',
+                          return_value={'abc': Mock()}) as mock_hw:
+            snapshot.get_nodes_hardware([machine])
+            snapshot.refresh(keep_hardware=True)
+            snapshot.get_nodes_hardware([machine])
+            self.assertEqual(1, mock_hw.call_count)
+
+            machine._data = {'current_commissioning_result_id': 2}
+            snapshot.get_nodes_hardware([machine])
+            self.assertEqual(2, mock_hw.call_count)
+
+            snapshot.refresh()
+            snapshot.get_nodes_hardware([machine])
+            self.assertEqual(3, mock_hw.call_count)
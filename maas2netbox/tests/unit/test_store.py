@@ -0,0 +1,156 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib
+import os
+import tempfile
+import unittest
+
+from mock import patch, Mock
+
+SWITCH_CONNECTION = {
+    'name': 'eno1', 'switch_name': 'Switch1', 'switch_port': 'Ethernet1',
+    'vid': '100', 'cable_color': '2196f3'}
+
+
+class SnapshotStoreTesting(unittest.TestCase):
+
+    def setUp(self):
+        modules = {
+            'maas2netbox.config': Mock(),
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        # Imported afresh, so that stored records compare with these
+        records = importlib.import_module('maas2netbox.records')
+        store = importlib.import_module('maas2netbox.store')
+        from maas2netbox import validators
+        from maas2netbox.utils.maas import NodeHardware
+        from maas2netbox.utils.netbox import Item
+        self.store = store
+        self.validators = validators
+        self.directory = tempfile.TemporaryDirectory()
+        self.snapshot_store = store.SnapshotStore(
+            os.path.join(self.directory.name, 'snapshots.db'))
+
+        hardware = NodeHardware(
+            serial='ABC123',
+            interfaces=[
+                {'name': 'eno1', 'mac_address': 'AA:BB', 'type': '1150'},
+                {'name': 'eno2', 'mac_address': 'CC:DD', 'type': '1000'},
+                {'name': 'eno3', 'mac_address': 'EE:FF'}],
+            switch_connections=[SWITCH_CONNECTION])
+        self.maas_nodes = [
+            records.MaaSNode('abc', 'node1', 'DEPLOYED', 'ubuntu-bionic',
+                             '10.0.0.1', hardware),
+            records.MaaSNode('def', 'node2', 'NEW')]
+        self.netbox_nodes = [
+            records.NetBoxNode(1, 'NODE1', 'XYZ', 'Active', '10.0.0.1/24',
+                               'ubuntu-bionic', '')]
+
+        netbox_api = Mock()
+        netbox_api.get_switch.return_value = Item({'id': 5, 'name': 'switch1'})
+        netbox_api.get_nodes_interfaces.side_effect = [
+            [Item({'id': 11, 'name': 'eno1', 'mac_address': 'AA:BB',
+                   'device': {'id': 1}, 'lag': None,
+                   'untagged_vlan': {'id': 7}})],
+            [Item({'id': 51, 'name': 'Ethernet1', 'device': {'id': 5}})],
+        ]
+        netbox_api.cables = {
+            (11, 51): Item({'id': 3, 'termination_a_id': 11,
+                            'termination_b_id': 51, 'color': '2196f3'})}
+        netbox_api.reference_data = {'vlans': {'100': 7}}
+        snapshot = Mock(netbox_api=netbox_api, netbox_nodes=self.netbox_nodes)
+        snapshot.load_maas_nodes.return_value = self.maas_nodes
+        self.snapshot_id = self.snapshot_store.record(snapshot)
+
+    def tearDown(self):
+        self.snapshot_store.close()
+        self.directory.cleanup()
+        self.module_patcher.stop()
+
+    def get_stored_snapshot(self):
+        return self.store.StoredSnapshot(self.snapshot_store)
+
+    def test_round_trip(self):
+        snapshot = self.get_stored_snapshot()
+
+        self.assertEqual(self.snapshot_id, snapshot.snapshot_id)
+        self.assertEqual(self.maas_nodes, snapshot.maas_nodes)
+        self.assertEqual(self.netbox_nodes, list(snapshot.iter_netbox_nodes()))
+
+    def test_maas_nodes_without_maas(self):
+        snapshot = self.get_stored_snapshot()
+
+        with patch('maas2netbox.snapshot.maas') as mock_maas:
+            nodes = snapshot.load_maas_nodes(hardware=True)
+
+        self.assertEqual(self.maas_nodes, nodes)
+        self.assertFalse(hasattr(snapshot, 'maas_machines'))
+        mock_maas.get_nodes.assert_not_called()
+
+    def test_stored_netbox_lookups(self):
+        netbox_api = self.get_stored_snapshot().netbox_api
+
+        self.assertEqual(5, netbox_api.get_switch('SWITCH1').id)
+        self.assertEqual(
+            51, netbox_api.get_switch_port('Switch1', 'Ethernet1').id)
+        self.assertEqual(7, netbox_api.get_vlan_id(100))
+        self.assertEqual('2196f3', netbox_api.get_cable(51, 11).color)
+        self.assertEqual(
+            7, netbox_api.get_node_interfaces(1, 'eno1')[0].untagged_vlan.id)
+
+    def test_offline_validation(self):
+        snapshot = self.get_stored_snapshot()
+
+        serial_errors = self.validators.SerialNumberValidator(
+            use_maas=True, snapshot=snapshot).check_nodes()
+        interface_errors = self.validators.InterfacesValidator(
+            use_maas=True, snapshot=snapshot).check_nodes()
+        self.validators.SwitchConnectionsValidator(
+            use_maas=True, snapshot=snapshot).check_nodes()
+
+        self.assertEqual('ABC123', serial_errors[1]['expected'])
+        self.assertEqual(
+            [{'name': 'eno2', 'mac_address': 'CC:DD', 'type': '1000'}],
+            interface_errors[1]['expected'])
+
+    def test_query_from_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        snapshot = self.get_stored_snapshot()
+        validators = [
+            self.validators.SerialNumberValidator(
+                use_maas=True, snapshot=snapshot),
+            self.validators.InterfacesValidator(
+                use_maas=True, snapshot=snapshot)]
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(
+                lambda validator: validator.check_nodes(), validators))
+
+        self.assertEqual('ABC123', results[0][1]['expected'])
+        self.assertEqual(1, len(results[1][1]['expected']))
+
+    def test_latest_snapshot_missing(self):
+        empty_store = self.store.SnapshotStore(':memory:')
+
+        with self.assertRaises(LookupError):
+            self.store.StoredSnapshot(empty_store)
+
+    def test_unknown_snapshot(self):
+        for snapshot_id in (0, self.snapshot_id + 1):
+            with self.assertRaises(LookupError):
+                self.store.StoredSnapshot(self.snapshot_store, snapshot_id)
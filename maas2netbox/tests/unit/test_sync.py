@@ -0,0 +1,104 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tempfile
+import unittest
+
+from mock import patch, Mock
+
+
+def get_machine(system_id, hostname='node1', status='DEPLOYED'):
+    machine = Mock(system_id=system_id, hostname=hostname,
+                   osystem='ubuntu', distro_series='bionic')
+    machine.status.name = status
+    machine._data = {
+        'current_commissioning_result_id': 7,
+        'interface_set': [{
+            'name': 'eno1', 'mac_address': 'aa:bb:cc:dd:ee:ff',
+            'links': [{'ip_address': '10.0.0.1'}]}],
+    }
+    return machine
+
+
+class ChangeTrackerTesting(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        mock_config = Mock()
+        mock_config.maas_sweep_interval = 3600
+        modules = {
+            'maas2netbox.config': mock_config,
+        }
+
+        self.module_patcher = patch.dict('sys.modules', modules)
+        self.module_patcher.start()
+        from maas2netbox import sync
+        self.sync = sync
+        self.cache_patcher = patch.object(
+            sync.cache, 'get_cache', return_value=sync.cache.FileCache(
+                self.directory.name))
+        self.cache_patcher.start()
+        self.config_patcher = patch.object(sync, 'config', mock_config)
+        self.config_patcher.start()
+
+    def tearDown(self):
+        self.config_patcher.stop()
+        self.cache_patcher.stop()
+        self.module_patcher.stop()
+        self.directory.cleanup()
+
+    def run_tracker(self, machines, **kwargs):
+        tracker = self.sync.ChangeTracker('status', **kwargs)
+        changed = tracker.changed(machines)
+        tracker.save()
+        return tracker, changed
+
+    def test_only_changed_machines(self):
+        machines = [get_machine('abc'), get_machine('def')]
+        tracker, changed = self.run_tracker(machines)
+        self.assertTrue(tracker.full_sweep)
+        self.assertEqual(machines, changed)
+
+        machines = [get_machine('abc'), get_machine('def', status='READY')]
+        tracker, changed = self.run_tracker(machines)
+        self.assertFalse(tracker.full_sweep)
+        self.assertEqual([machines[1]], changed)
+
+        machines[0]._data['interface_set'][0]['links'] = []
+        tracker, changed = self.run_tracker(machines)
+        self.assertEqual([machines[0]], changed)
+
+    def test_discarded_machines_are_checked_again(self):
+        tracker = self.sync.ChangeTracker('status')
+        tracker.changed([get_machine('abc')])
+        tracker.discard(['abc'])
+        tracker.save()
+
+        _, changed = self.run_tracker([get_machine('abc')])
+        self.assertEqual(1, len(changed))
+
+    def test_full_sweep(self):
+        self.run_tracker([get_machine('abc')])
+
+        tracker, changed = self.run_tracker(
+            [get_machine('abc')], sweep_interval=0)
+        self.assertTrue(tracker.full_sweep)
+        self.assertEqual(1, len(changed))
+
+    def test_fields_are_tracked_separately(self):
+        self.run_tracker([get_machine('abc')])
+
+        tracker = self.sync.ChangeTracker('serialnumber')
+        self.assertEqual(1, len(tracker.changed([get_machine('abc')])))
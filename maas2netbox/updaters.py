@@ -18,7 +18,7 @@ from maas2netbox.utils import netbox
 
 class Updater(object):
     def __init__(self, nodes_updates):
-        self.netbox_api = netbox.NetBoxAPI()
+        self.netbox_api = netbox.get_netbox_api()
         self.nodes_updates = nodes_updates
 
     def get_node_custom_fields(self, node_id):
@@ -32,58 +32,51 @@ class Updater(object):
 class SerialNumberUpdater(Updater):
 
     def update_nodes(self):
-        for node_id, value in self.nodes_updates.items():
-            self.netbox_api.patch_node(node_id, {'serial': value['expected']})
+        self.netbox_api.patch_nodes([
+            {'id': node_id, 'serial': value['expected']}
+            for node_id, value in self.nodes_updates.items()])
 
 
 class StatusUpdater(Updater):
 
     def get_status_value(self, status_text):
-        status_value = None
-        statuses = self.netbox_api.get_node_statuses()
-        for status in statuses:
-            if status['label'] == status_text:
-                status_value = status['value']
-        return status_value
+        return self.netbox_api.get_status_value(status_text)
 
     def update_nodes(self):
-        for node_id, value in self.nodes_updates.items():
-            status_value = self.get_status_value(value['expected'])
-            self.netbox_api.patch_node(node_id, {'status': status_value})
+        self.netbox_api.patch_nodes([
+            {'id': node_id, 'status': self.get_status_value(value['expected'])}
+            for node_id, value in self.nodes_updates.items()])
 
 
 class PrimaryIPv4Updater(Updater):
 
     def update_nodes(self):
-        for node_id, value in self.nodes_updates.items():
-            self.netbox_api.patch_node(
-                node_id, {'primary_ip4': value['expected']})
+        self.netbox_api.patch_nodes([
+            {'id': node_id, 'primary_ip4': value['expected']}
+            for node_id, value in self.nodes_updates.items()])
 
 
 class InterfacesUpdater(Updater):
 
     def update_nodes(self):
+        interfaces = []
         for node_id, value in self.nodes_updates.items():
             for interface in value['expected']:
                 interface['device'] = node_id
-                self.netbox_api.create_interface(interface)
+                interfaces.append(interface)
+        self.netbox_api.create_interfaces(interfaces)
 
 
 class PlatformUpdater(Updater):
 
     def get_platform_id(self, value):
-        platform_id = None
-        platforms = self.netbox_api.get_node_platforms()
-        for platform in platforms:
-            if platform.slug == value:
-                platform_id = platform.id
-                break
-        return platform_id
+        return self.netbox_api.get_platform_id(value)
 
     def update_nodes(self):
-        for node_id, value in self.nodes_updates.items():
-            self.netbox_api.patch_node(
-                node_id, {'platform': self.get_platform_id(value['expected'])})
+        self.netbox_api.patch_nodes([
+            {'id': node_id,
+             'platform': self.get_platform_id(value['expected'])}
+            for node_id, value in self.nodes_updates.items()])
 
 
 class ExperimentalUpdater(Updater):
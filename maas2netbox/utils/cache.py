@@ -0,0 +1,93 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from maas2netbox import config
+
+
+class FileCache(object):
+    """JSON documents stored as files under a directory"""
+
+    def __init__(self, directory, ttl=None, max_entries=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{}.json'.format(digest))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _list_paths(self):
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory) if name.endswith('.json')]
+
+    def set(self, key, value):
+        path = self._path(key)
+        is_new = not os.path.exists(path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(value, cache_file)
+        os.replace(tmp_path, path)
+        if self.max_entries and is_new:
+            if self._entries is None:
+                self._entries = len(self._list_paths())
+            else:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        paths = self._list_paths()
+        if len(paths) > self.max_entries:
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:len(paths) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._entries = min(len(paths), self.max_entries)
+
+
+def get_cache(name, ttl=None, max_entries=None):
+    """Return the named on-disk cache or None if caching is disabled"""
+    if not config.cache_dir:
+        return None
+    return FileCache(
+        os.path.join(config.cache_dir, name), ttl=ttl,
+        max_entries=max_entries)
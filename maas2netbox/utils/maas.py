@@ -13,52 +13,112 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import hashlib
+import json
+import logging
 import re
+from collections import namedtuple
+from inspect import isawaitable
+from urllib.parse import urljoin, urlparse
 from xml.etree import ElementTree
 
-from maas import client
+import requests
+from maas.client.bones import helpers
+from maas.client.facade import Client
+from maas.client.utils import api_url
+from maas.client.utils.profiles import Profile
+from maas.client.viscera import Origin
 
 from maas2netbox import config
+from maas2netbox.utils import cache
+
+# NetBox interface type of the NICs handled by each kernel driver
+DRIVER_TYPES = {
+    'igb': '1000',
+    'ixgbe': '1150',
+}
+
+NodeHardware = namedtuple(
+    'NodeHardware', ['serial', 'interfaces', 'switch_connections'])
+
+# Bump whenever parsing changes so that cached hardware is parsed again
+HARDWARE_CACHE_VERSION = 1
+
+
+_client = None
+
+
+def get_server_version():
+    """Cheap anonymous probe of the MaaS version, None when unavailable"""
+    try:
+        response = requests.get(
+            urljoin(api_url(config.maas_url), 'version/'), timeout=10)
+        response.raise_for_status()
+        version = response.json()
+        return '{}-{}'.format(version['version'], version['subversion'])
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+
+def get_profile():
+    """Profile to connect with, reusing a cached API description"""
+    url = api_url(config.maas_url)
+    description_cache = cache.get_cache('maas-api')
+    key = 'api-description:{}'.format(url)
+    version = get_server_version() if description_cache else None
+
+    if version:
+        cached = description_cache.get(key)
+        if cached and cached['version'] == version:
+            return Profile(
+                name=urlparse(url).netloc, url=url,
+                credentials=config.maas_api_key,
+                description=cached['description'])
+
+    profile = helpers.connect(url, apikey=config.maas_api_key)
+    if version:
+        description_cache.set(
+            key, {'version': version, 'description': profile.description})
+    return profile
+
+
+def get_client():
+    """Process-wide MaaS client, connected on first use only"""
+    global _client
+    if _client is None:
+        _client = Client(Origin.fromProfile(get_profile()))
+    return _client
 
 
 def get_nodes():
-    cli = client.connect(config.maas_url, apikey=config.maas_api_key)
+    cli = get_client()
     nodes = cli.machines.list()
 
     return nodes
 
 
-def get_node_serial(node):
-    serial = None
+def parse_xml(document):
     try:
-        node_details = node.get_details()['lshw']
-        tree = ElementTree.fromstring(node_details)
-        serial = tree.findall("./node[@class='system']/serial")[0].text
-    except (KeyError, AttributeError, IndexError, ElementTree.ParseError):
-        pass
-
-    return serial
+        return ElementTree.fromstring(document)
+    except (TypeError, ElementTree.ParseError):
+        return None
 
 
-def get_interface_ipv4_address(iface):
-    address = None
+def parse_serial(lshw):
+    serial = None
     try:
-        address = iface.links[0].ip_address
-        mask = iface.links[0].subnet.cidr.split('/')[-1]
-        if address and mask:
-            address = '{}/{}'.format(address, mask)
-    except (IndexError, AttributeError):
+        serial = lshw.findall("./node[@class='system']/serial")[0].text
+    except (AttributeError, IndexError):
         pass
 
-    return address
+    return serial
 
 
-def get_node_interfaces(node):
+def parse_interfaces(lshw):
     ifaces = []
     try:
-        node_details = node.get_details()['lshw']
-        tree = ElementTree.fromstring(node_details)
-        ifaces_objects = tree.findall(
+        ifaces_objects = lshw.findall(
             "node[@class='system']/node[@class='bus']/"
             "node[@class='bridge']/node[@class='bridge']/"
             "node[@class='network']")
@@ -70,36 +130,23 @@ def get_node_interfaces(node):
                 elif iface_property.tag == 'logicalname':
                     iface['name'] = iface_property.text
                 elif iface_property.tag == 'configuration':
-                    for conf_property in iface_property.getchildren():
+                    for conf_property in iface_property:
                         if conf_property.attrib['id'] == 'driver':
-                            if conf_property.attrib['value'] == 'igb':
-                                iface['type'] = '1000'
-                            elif conf_property.attrib['value'] == 'ixgbe':
-                                iface['type'] = '1150'
+                            iface_type = DRIVER_TYPES.get(
+                                conf_property.attrib['value'])
+                            if iface_type:
+                                iface['type'] = iface_type
             ifaces.append(iface)
-    except (KeyError, IndexError, AttributeError, ElementTree.ParseError):
+    except (KeyError, IndexError, AttributeError):
         pass
 
     return ifaces
 
 
-def calculate_color(text):
-    color = None
-    try:
-        color_name = re.findall(r'\(.*port: (\w+)\)', text)[0]
-        color = config.CABLE_COLORS[color_name]
-    except (KeyError, IndexError):
-        pass
-
-    return color
-
-
-def get_switch_connection_details(node):
+def parse_switch_connections(lldp):
     ifaces = []
     try:
-        node_details = node.get_details()['lldp']
-        tree = ElementTree.fromstring(node_details)
-        ifaces_objects = tree.findall('interface')
+        ifaces_objects = lldp.findall('interface')
         for iface_object in ifaces_objects:
             iface = {
                 'name': iface_object.attrib['name'],
@@ -110,7 +157,153 @@ def get_switch_connection_details(node):
                     iface_object.find('port/descr').text)
             }
             ifaces.append(iface)
-    except (KeyError, AttributeError, ElementTree.ParseError):
+    except (KeyError, AttributeError):
         pass
 
     return ifaces
+
+
+def parse_details(details):
+    lshw = parse_xml(details.get('lshw'))
+    lldp = parse_xml(details.get('lldp'))
+
+    return NodeHardware(
+        serial=parse_serial(lshw),
+        interfaces=parse_interfaces(lshw),
+        switch_connections=parse_switch_connections(lldp))
+
+
+def get_commissioning_marker(node):
+    """Identify the commissioning run whose details a node reports"""
+    try:
+        return node._data.get('current_commissioning_result_id')
+    except AttributeError:
+        return None
+
+
+def get_machine_fingerprint(node):
+    """Digest of the machine attributes reconciled with NetBox"""
+    interfaces = sorted(
+        [iface.get('name'), iface.get('mac_address'),
+         sorted(link.get('ip_address') or ''
+                for link in iface.get('links', []))]
+        for iface in node._data.get('interface_set', []))
+    fields = [node.status.name, node.hostname, node.osystem,
+              node.distro_series, interfaces, get_commissioning_marker(node)]
+    data = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+def get_hardware_cache_key(node):
+    marker = get_commissioning_marker(node)
+    if marker is None:
+        return None
+    return '{}:{}:{}'.format(HARDWARE_CACHE_VERSION, node.system_id, marker)
+
+
+def get_hardware_cache():
+    return cache.get_cache('maas', max_entries=config.maas_cache_size)
+
+
+def get_cached_hardware(hardware_cache, node):
+    key = get_hardware_cache_key(node)
+    if hardware_cache and key:
+        hardware = hardware_cache.get(key)
+        if hardware:
+            return NodeHardware(**hardware)
+    return None
+
+
+def cache_hardware(hardware_cache, node, hardware):
+    key = get_hardware_cache_key(node)
+    if hardware_cache and key:
+        hardware_cache.set(key, hardware._asdict())
+
+
+def get_node_hardware(node):
+    """Fetch commissioning details of a node once and parse them once"""
+    hardware_cache = get_hardware_cache()
+    hardware = get_cached_hardware(hardware_cache, node)
+    if not hardware:
+        hardware = parse_details(node.get_details())
+        cache_hardware(hardware_cache, node, hardware)
+    return hardware
+
+
+async def _get_node_details(node, semaphore):
+    async with semaphore:
+        details = node.get_details()
+        if isawaitable(details):
+            details = await details
+    return details
+
+
+async def _get_nodes_hardware(nodes, concurrency, hardware_cache):
+    nodes_hardware = {}
+    missing = []
+    for node in nodes:
+        hardware = get_cached_hardware(hardware_cache, node)
+        if hardware:
+            nodes_hardware[node.system_id] = hardware
+        else:
+            missing.append(node)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *[_get_node_details(node, semaphore) for node in missing],
+        return_exceptions=True)
+
+    for node, details in zip(missing, results):
+        if isinstance(details, Exception):
+            logging.error('Node: {} Failed to fetch details: {}'.format(
+                node.hostname, details))
+            continue
+        hardware = parse_details(details)
+        cache_hardware(hardware_cache, node, hardware)
+        nodes_hardware[node.system_id] = hardware
+    return nodes_hardware
+
+
+def get_nodes_hardware(nodes, concurrency=None):
+    """Fetch commissioning details of many nodes, `concurrency` at a time"""
+    concurrency = concurrency or config.maas_concurrency
+    # The batch must run on the loop python-libmaas is bound to
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(
+        _get_nodes_hardware(list(nodes), concurrency, get_hardware_cache()))
+
+
+def get_node_serial(node):
+    return get_node_hardware(node).serial
+
+
+def get_interface_ipv4_address(iface):
+    address = None
+    try:
+        address = iface.links[0].ip_address
+        mask = iface.links[0].subnet.cidr.split('/')[-1]
+        if address and mask:
+            address = '{}/{}'.format(address, mask)
+    except (IndexError, AttributeError):
+        pass
+
+    return address
+
+
+def get_node_interfaces(node):
+    return get_node_hardware(node).interfaces
+
+
+def calculate_color(text):
+    color = None
+    try:
+        color_name = re.findall(r'\(.*port: (\w+)\)', text)[0]
+        color = config.CABLE_COLORS[color_name]
+    except (KeyError, IndexError):
+        pass
+
+    return color
+
+
+def get_switch_connection_details(node):
+    return get_node_hardware(node).switch_connections
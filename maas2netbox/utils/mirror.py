@@ -0,0 +1,170 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from maas2netbox.utils.netbox import chunks, FILTER_CHUNK_SIZE
+
+# Bump whenever the stored layout changes so that mirrors are loaded again
+MIRROR_VERSION = 1
+
+
+class Scope(object):
+    """Restricts a table to the children of some parent objects"""
+
+    def __init__(self, name, parent_ids, get_parent_id,
+                 chunk_size=FILTER_CHUNK_SIZE):
+        self.name = name
+        self.parent_ids = set(parent_ids)
+        self.get_parent_id = get_parent_id
+        self.chunk_size = chunk_size
+
+    def iter_filters(self, parent_ids=None):
+        if parent_ids is None:
+            parent_ids = self.parent_ids
+        for chunk in chunks(sorted(parent_ids), self.chunk_size):
+            yield {self.name: chunk}
+
+
+class NetBoxMirror(object):
+    """Local copy of NetBox listings, kept in the on-disk cache"""
+
+    def __init__(self, netbox_api, file_cache, key_prefix, sweep_interval):
+        self.netbox_api = netbox_api
+        self.cache = file_cache
+        self.key_prefix = key_prefix
+        self.sweep_interval = sweep_interval
+        self._tables = {}
+        self.lock = threading.RLock()
+
+    def reset(self):
+        """Synchronize tables again on next access"""
+        self._tables = {}
+
+    def get_key(self, name):
+        return '{}:{}'.format(self.key_prefix, name)
+
+    def load(self, name, endpoint, filters=None, scope=None):
+        """Objects of a table keyed by id, as JSON values"""
+        with self.lock:
+            if name not in self._tables:
+                self._tables[name] = self.sync(
+                    name, endpoint, filters or {}, scope)
+            return self._tables[name]
+
+    def update(self, name, values):
+        """Record objects created or changed through this process"""
+        with self.lock:
+            table = self._tables.get(name)
+            if table is not None:
+                for value in values:
+                    table[value['id']] = value
+
+    def fetch(self, endpoint, filters, scope, parent_ids=None):
+        objects = {}
+        scope_filters = scope.iter_filters(parent_ids) if scope else [{}]
+        for scope_filter in scope_filters:
+            for item in self.netbox_api.filter(
+                    endpoint, **dict(filters, **scope_filter)):
+                objects[item.id] = item.serialize()
+        return objects
+
+    def sync(self, name, endpoint, filters, scope):
+        key = self.get_key(name)
+        state = self.cache.get(key)
+        if (
+            not state or state['version'] != MIRROR_VERSION
+            or state['filters'] != filters or not state['since']
+            or state['swept'] + self.sweep_interval < time.time()
+        ):
+            logging.info('Mirroring all NetBox {}'.format(name))
+            objects = self.fetch(endpoint, filters, scope)
+            swept = time.time()
+        else:
+            objects = {
+                int(object_id): values
+                for object_id, values in state['objects'].items()}
+            swept = state['swept']
+            updated = self.sync_changes(
+                endpoint, filters, scope, objects, state)
+            deleted = self.sync_deletions(endpoint, filters, scope, objects)
+            logging.info('NetBox {}: {} updated, {} deleted'.format(
+                name, updated, deleted))
+
+        self.cache.set(key, {
+            'version': MIRROR_VERSION,
+            'filters': filters,
+            'swept': swept,
+            'since': max(
+                (values.get('last_updated') or '' for values in
+                 objects.values()), default=''),
+            'parents': sorted(scope.parent_ids) if scope else [],
+            'objects': objects,
+        })
+        return objects
+
+    def sync_changes(self, endpoint, filters, scope, objects, state):
+        updated = 0
+        if scope:
+            # Children of parents no longer mirrored are dropped, while
+            # those of new parents are read in full
+            for object_id, values in list(objects.items()):
+                if scope.get_parent_id(values) not in scope.parent_ids:
+                    del objects[object_id]
+            new_parent_ids = scope.parent_ids - set(state['parents'])
+            new_objects = self.fetch(endpoint, filters, scope, new_parent_ids)
+            objects.update(new_objects)
+            updated += len(new_objects)
+
+        # Children are read without the scope filter, which could take many
+        # requests, and kept if their parent is mirrored
+        for item in self.netbox_api.filter(
+                endpoint, last_updated__gte=state['since'], **filters):
+            values = item.serialize()
+            if scope and scope.get_parent_id(values) not in scope.parent_ids:
+                objects.pop(item.id, None)
+                continue
+            objects[item.id] = values
+            updated += 1
+        return updated
+
+    def sync_deletions(self, endpoint, filters, scope, objects):
+        if not scope:
+            groups = [(filters, set(objects))]
+        else:
+            children = defaultdict(set)
+            for object_id, values in objects.items():
+                children[scope.get_parent_id(values)].add(object_id)
+            groups = [
+                (dict(filters, **scope_filter), set(
+                    object_id for parent_id in scope_filter[scope.name]
+                    for object_id in children[parent_id]))
+                for scope_filter in scope.iter_filters()]
+
+        deleted = 0
+        for group_filters, object_ids in groups:
+            if self.netbox_api.count(endpoint, **group_filters) == len(
+                    object_ids):
+                continue
+            existing = set(
+                item.id for item in self.netbox_api.filter(
+                    endpoint, brief=1, **group_filters))
+            for object_id in object_ids - existing:
+                del objects[object_id]
+                deleted += 1
+        return deleted
@@ -13,80 +13,593 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import ipaddress
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 import pynetbox
+import requests
+from requests.adapters import HTTPAdapter
 
 from maas2netbox import config
+from maas2netbox.utils import cache
+
+# Number of ids sent in a single multi-value filter, so that the query string
+# stays well below the URL length limits of common web servers
+FILTER_CHUNK_SIZE = 100
+
+
+def chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+_lock = threading.Lock()
+_session = None
+_netbox_api = None
+
+
+def get_session():
+    """Process-wide keep-alive HTTP session towards NetBox"""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=config.netbox_pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'Accept': 'application/json',
+                'Accept-Encoding': 'gzip',
+                'Authorization': 'Token {}'.format(config.netbox_token),
+            })
+            _session = session
+    return _session
+
+
+def get_netbox_api():
+    """Process-wide NetBoxAPI, so that its indexes are built only once"""
+    global _netbox_api
+    session = get_session()
+    with _lock:
+        if _netbox_api is None:
+            _netbox_api = NetBoxAPI(session)
+    return _netbox_api
+
+
+class Item(object):
+    """Lightweight read-only view of a NetBox JSON object"""
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getattr__(self, name):
+        try:
+            value = self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+        if isinstance(value, dict):
+            return Item(value)
+        if isinstance(value, list):
+            return [Item(i) if isinstance(i, dict) else i for i in value]
+        return value
+
+    def __eq__(self, other):
+        return isinstance(other, Item) and self._values == other._values
+
+    def __hash__(self):
+        return hash(self._values.get('id'))
+
+    def __repr__(self):
+        return str(
+            self._values.get('name') or self._values.get('address')
+            or self._values.get('label') or self._values.get('id'))
+
+    def serialize(self):
+        return self._values
+
+
+def get_address_host(address):
+    return address.split('/')[0]
+
+
+def get_address_node_id(values):
+    """Id of the device an IP address is assigned to, if any"""
+    iface = values.get('interface') or values.get('assigned_object') or {}
+    return (iface.get('device') or {}).get('id')
+
+
+def index_choices(choices):
+    """Map choice labels to values, flattening grouped choices"""
+    index = {}
+    for choice in choices:
+        if isinstance(choice['value'], list):
+            index.update(index_choices(choice['value']))
+        else:
+            index[choice['label']] = choice['value']
+    return index
 
 
 class NetBoxAPI(object):
-    def __init__(self):
+    def __init__(self, session=None):
+        # pynetbox builds endpoint URLs and records, while requests go
+        # through the pooled session
         self.api = pynetbox.api(
             config.netbox_url,
             token=config.netbox_token
         )
+        self.session = session or get_session()
+        self._cables = None
+        self._reference_data = None
+        self._reference_data_fresh = False
+        self._ip_addresses = set()
+        self._ip_prefixes = set()
+        self._switches = {}
+        self._switch_ports = {}
+        self._mirror = None
+        self._interfaces_by_node = None
+
+    def refresh(self):
+        """Forget indexes of objects that change often"""
+        self._cables = None
+        self._ip_addresses = set()
+        self._ip_prefixes = set()
+        self._interfaces_by_node = None
+        if self._mirror:
+            self._mirror.reset()
+
+    @property
+    def mirror(self):
+        """Local mirror of NetBox objects, None unless NETBOX_MIRROR is set"""
+        if self._mirror is None and config.netbox_mirror:
+            mirror_cache = cache.get_cache('netbox-mirror')
+            if mirror_cache:
+                from maas2netbox.utils.mirror import NetBoxMirror
+                self._mirror = NetBoxMirror(
+                    self, mirror_cache,
+                    'mirror:{}:{}'.format(config.netbox_url, config.site_name),
+                    config.netbox_sweep_interval)
+        return self._mirror
+
+    def get_mirrored_nodes(self):
+        return self.mirror.load(
+            'devices', self.api.dcim.devices,
+            {'exclude': 'config_context', 'site': config.site_name,
+             'device_type_id': config.netbox_device_ids})
+
+    def get_mirrored_interfaces(self):
+        from maas2netbox.utils.mirror import Scope
+        return self.mirror.load(
+            'interfaces', self.api.dcim.interfaces,
+            scope=Scope('device_id', self.get_mirrored_nodes(),
+                        lambda values: values['device']['id']))
+
+    def get_mirrored_ip_addresses(self):
+        from maas2netbox.utils.mirror import Scope
+        return self.mirror.load(
+            'ip-addresses', self.api.ipam.ip_addresses,
+            scope=Scope('device_id', self.get_mirrored_nodes(),
+                        get_address_node_id))
+
+    def get_mirrored_cables(self):
+        return self.mirror.load(
+            'cables', self.api.dcim.cables, {'site': config.site_name})
+
+    def get_mirrored_vlans(self):
+        return self.mirror.load(
+            'vlans', self.api.ipam.vlans, {'site': config.site_name})
+
+    @property
+    def interfaces_by_node(self):
+        """Mirrored interfaces grouped by device id"""
+        with self.mirror.lock:
+            if self._interfaces_by_node is None:
+                interfaces = {}
+                for values in self.get_mirrored_interfaces().values():
+                    interfaces.setdefault(
+                        values['device']['id'], []).append(Item(values))
+                self._interfaces_by_node = interfaces
+            return self._interfaces_by_node
+
+    def update_mirror(self, name, records):
+        if self.mirror:
+            with self.mirror.lock:
+                self.mirror.update(
+                    name, [record.serialize() for record in records])
+                if name == 'interfaces':
+                    self._interfaces_by_node = None
+
+    def request(self, method, url, data=None, params=None):
+        response = self.session.request(
+            method, url, params=params,
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(data) if data is not None else None,
+            timeout=config.netbox_timeout)
+        if not response.ok:
+            raise pynetbox.RequestError(response)
+        return response.json()
+
+    @staticmethod
+    def load_record(endpoint, values):
+        return Item(values)
+
+    def filter(self, endpoint, **filters):
+        """Read every page of an endpoint listing"""
+        return [
+            record for page in self.iter_pages(endpoint, **filters)
+            for record in page]
+
+    def iter_pages(self, endpoint, **filters):
+        """Yield the pages of an endpoint listing in order"""
+        url = '{}/'.format(endpoint.url)
+
+        def get_page(offset, limit):
+            params = dict(filters, offset=offset, limit=limit)
+            return [
+                self.load_record(endpoint, values)
+                for values in self.request('get', url, params=params)[
+                    'results']]
+
+        params = dict(filters, offset=0, limit=config.netbox_page_size)
+        first_page = self.request('get', url, params=params)
+        page_size = len(first_page['results'])
+        yield [
+            self.load_record(endpoint, values)
+            for values in first_page['results']]
+        if not page_size or not first_page['next']:
+            return
+
+        # The server may cap the page size below the requested one
+        offsets = iter(range(page_size, first_page['count'], page_size))
+        workers = config.netbox_page_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = deque(
+                executor.submit(get_page, offset, page_size)
+                for offset in islice(offsets, workers))
+            while futures:
+                page = futures.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    futures.append(
+                        executor.submit(get_page, offset, page_size))
+                yield page
+
+    def get(self, endpoint, key):
+        return self.load_record(
+            endpoint, self.request('get', '{}/{}/'.format(endpoint.url, key)))
+
+    def count(self, endpoint, **filters):
+        """Number of objects of a listing, reading a single object"""
+        return self.request(
+            'get', '{}/'.format(endpoint.url),
+            params=dict(filters, limit=1))['count']
 
     def get_nodes(self):
-        return self.api.dcim.devices.filter(
+        if self.mirror:
+            return sorted(
+                (Item(values)
+                 for values in self.get_mirrored_nodes().values()),
+                key=lambda node: node.name or '')
+        return self.filter(
+            self.api.dcim.devices, exclude='config_context',
+            site=config.site_name, device_type_id=config.netbox_device_ids)
+
+    def iter_nodes_pages(self):
+        if self.mirror:
+            return chunks(self.get_nodes(), config.netbox_page_size)
+        # Config contexts are rendered per device and never read here
+        return self.iter_pages(
+            self.api.dcim.devices, exclude='config_context',
             site=config.site_name, device_type_id=config.netbox_device_ids)
 
+    def get_nodes_by_id(self, node_ids):
+        nodes = []
+        for chunk in chunks(sorted(node_ids), FILTER_CHUNK_SIZE):
+            nodes.extend(self.filter(
+                self.api.dcim.devices, exclude='config_context',
+                id__in=','.join(str(node_id) for node_id in chunk)))
+        return nodes
+
     def get_node_by_name(self, name):
-        return self.api.dcim.devices.get(name=name)
+        nodes = self.filter(self.api.dcim.devices, name=name)
+        return nodes[0] if nodes else None
 
     def get_node(self, node_id):
-        return self.api.dcim.devices.get(node_id)
+        return self.get(self.api.dcim.devices, node_id)
 
     def get_node_interface(self, interface_id):
-        return self.api.dcim.interfaces.get(interface_id)
+        if self.mirror:
+            values = self.get_mirrored_interfaces().get(interface_id)
+            if values:
+                return Item(values)
+        return self.get(self.api.dcim.interfaces, interface_id)
 
     def get_node_interfaces(self, node_id, name=''):
+        if self.mirror and node_id in self.get_mirrored_nodes():
+            return [
+                iface for iface in self.interfaces_by_node.get(node_id, [])
+                if not name or iface.name == name]
         if name:
-            return self.api.dcim.interfaces.filter(
-                device_id=node_id, name=name)
+            return self.filter(
+                self.api.dcim.interfaces, device_id=node_id, name=name)
         else:
-            return self.api.dcim.interfaces.filter(device_id=node_id)
+            return self.filter(self.api.dcim.interfaces, device_id=node_id)
+
+    def get_nodes_interfaces(self, node_ids, brief=False):
+        filters = {'brief': 1} if brief else {}
+        interfaces = []
+        if self.mirror:
+            # Only devices outside the mirror, such as switches, are read
+            mirrored_nodes = self.get_mirrored_nodes()
+            remote_ids = []
+            for node_id in node_ids:
+                if node_id in mirrored_nodes:
+                    interfaces.extend(self.interfaces_by_node.get(node_id, []))
+                else:
+                    remote_ids.append(node_id)
+            node_ids = remote_ids
+        for chunk in chunks(node_ids, FILTER_CHUNK_SIZE):
+            interfaces.extend(self.filter(
+                self.api.dcim.interfaces, device_id=chunk, **filters))
+        return interfaces
+
+    def load_switch_ports(self, switch_names):
+        """Index switches and their interfaces by name, once per switch"""
+        # NetBox matches names exactly, lookups here ignore case
+        missing = set(
+            name for name in switch_names
+            if name.lower() not in self._switches)
+        if not missing:
+            return
+
+        switches = {}
+        for chunk in chunks(sorted(missing), FILTER_CHUNK_SIZE):
+            for switch in self.filter(
+                    self.api.dcim.devices, name=chunk, brief=1):
+                switches[switch.id] = switch
+        for name in missing:
+            self._switches[name.lower()] = None
+        for switch in switches.values():
+            self._switches[switch.name.lower()] = switch
+
+        for iface in self.get_nodes_interfaces(switches.keys(), brief=True):
+            switch = switches[iface.device.id]
+            self._switch_ports[(switch.name.lower(), iface.name)] = iface
+
+    def get_switch(self, name):
+        self.load_switch_ports([name])
+        return self._switches[name.lower()]
+
+    def get_switch_port(self, switch_name, port):
+        self.load_switch_ports([switch_name])
+        return self._switch_ports.get((switch_name.lower(), port))
 
     def get_node_platforms(self):
-        return self.api.dcim.platforms.all()
+        return self.filter(self.api.dcim.platforms, brief=1)
+
+    def get_choices(self):
+        return self.request(
+            'get', '{}/dcim/_choices/'.format(self.api.base_url))
 
     def get_node_statuses(self):
-        return self.api.dcim.choices()['device:status']
+        return self.get_choices()['device:status']
 
     def get_interface_types(self):
-        return self.api.dcim.choices()['interface:type']
+        return self.get_choices()['interface:type']
+
+    @staticmethod
+    def get_reference_data_key():
+        return 'reference-data:{}:{}'.format(
+            config.netbox_url, config.site_name)
+
+    def load_reference_data(self):
+        choices = self.get_choices()
+        return {
+            'statuses': index_choices(choices['device:status']),
+            'interface_types': index_choices(choices['interface:type']),
+            'platforms': {
+                platform.slug: platform.id
+                for platform in self.get_node_platforms()},
+            'vlans': self.load_vlans(),
+        }
+
+    def load_vlans(self):
+        if self.mirror:
+            return {
+                str(values['vid']): values['id']
+                for values in self.get_mirrored_vlans().values()}
+        return {
+            str(vlan.vid): vlan.id
+            for vlan in self.filter(
+                self.api.ipam.vlans, site=config.site_name, brief=1)}
+
+    @property
+    def reference_data(self):
+        """Choices, platforms and site VLANs indexed for lookups"""
+        if self._reference_data is None:
+            reference_cache = cache.get_cache(
+                'netbox', ttl=config.netbox_cache_ttl)
+            if reference_cache:
+                self._reference_data = reference_cache.get(
+                    self.get_reference_data_key())
+            if self._reference_data is None:
+                self._reference_data = self.load_reference_data()
+                self._reference_data_fresh = True
+                if reference_cache:
+                    reference_cache.set(
+                        self.get_reference_data_key(), self._reference_data)
+        return self._reference_data
+
+    def invalidate_reference_data(self):
+        self._reference_data = None
+        self._reference_data_fresh = False
+        reference_cache = cache.get_cache('netbox')
+        if reference_cache:
+            reference_cache.delete(self.get_reference_data_key())
+
+    def lookup_reference_data(self, kind, key):
+        if key is None:
+            return None
+        try:
+            return self.reference_data[kind][key]
+        except KeyError:
+            # Cached data may predate the object, so reload once from NetBox
+            if self._reference_data_fresh:
+                return None
+            self.invalidate_reference_data()
+            return self.reference_data[kind].get(key)
+
+    def get_status_value(self, label):
+        return self.lookup_reference_data('statuses', label)
+
+    def get_interface_type_value(self, label):
+        return self.lookup_reference_data('interface_types', label)
+
+    def get_platform_id(self, slug):
+        return self.lookup_reference_data('platforms', slug)
 
     def get_vlan_id(self, vid):
-        return self.api.ipam.vlans.get(site=config.site_name, vid=vid).id
+        return self.lookup_reference_data('vlans', str(vid))
 
     def get_ip_address(self, address):
-        results = self.api.ipam.ip_addresses.filter(address=address)
+        results = self.filter(self.api.ipam.ip_addresses, address=address)
         if len(results) == 1:
             return results[0]
         else:
             return None
 
+    def _index_cable(self, cable):
+        if (
+            cable.termination_a_type == 'dcim.interface'
+            and cable.termination_b_type == 'dcim.interface'
+        ):
+            self._cables[
+                (cable.termination_a_id, cable.termination_b_id)] = cable
+            self._cables[
+                (cable.termination_b_id, cable.termination_a_id)] = cable
+
+    @property
+    def cables(self):
+        """Cables of the site keyed by their interface terminations"""
+        if self._cables is None:
+            self._cables = {}
+            if self.mirror:
+                cables = [
+                    Item(values)
+                    for values in self.get_mirrored_cables().values()]
+            else:
+                cables = self.filter(
+                    self.api.dcim.cables, site=config.site_name)
+            for cable in cables:
+                self._index_cable(cable)
+        return self._cables
+
+    def invalidate_cables(self):
+        self._cables = None
+
+    def load_ip_addresses(self, prefix):
+        """Index the hosts of all IP addresses inside a prefix, once"""
+        if prefix not in self._ip_prefixes:
+            for address in self.filter(
+                    self.api.ipam.ip_addresses, parent=prefix, brief=1):
+                self._ip_addresses.add(get_address_host(address.address))
+            self._ip_prefixes.add(prefix)
+
+    def has_ip_address(self, address):
+        if self.mirror and not self._ip_addresses:
+            # Addresses of mirrored devices spare most prefix listings
+            with self.mirror.lock:
+                self._ip_addresses.update(
+                    get_address_host(values['address'])
+                    for values in self.get_mirrored_ip_addresses().values())
+        if get_address_host(address) in self._ip_addresses:
+            return True
+        prefix = str(ipaddress.ip_interface(address).network)
+        self.load_ip_addresses(prefix)
+        return get_address_host(address) in self._ip_addresses
+
     def get_cable(self, node_iface, switch_iface):
-        cables = self.api.dcim.cables.filter(site=config.site_name)
-        for cable in cables:
-            if (
-                cable.termination_a_id == node_iface
-                and cable.termination_b_id == switch_iface
-            ):
-                return cable
-        return None
+        return self.cables.get((node_iface, switch_iface))
 
     def patch_interface(self, interface_id, data):
-        iface = self.api.dcim.interfaces.get(interface_id)
-        return iface.update(data)
+        values = self.request('patch', '{}/{}/'.format(
+            self.api.dcim.interfaces.url, interface_id), data)
+        self.update_mirror('interfaces', [Item(values)])
+        return True
 
     def patch_node(self, node_id, data):
-        node = self.api.dcim.devices.get(node_id)
-        return node.update(data)
+        self.request('patch', '{}/{}/'.format(
+            self.api.dcim.devices.url, node_id), data)
+        return True
+
+    def patch_nodes(self, updates):
+        """Update many devices with list-form PATCH requests"""
+        for chunk in chunks(updates, config.netbox_bulk_size):
+            try:
+                self.request(
+                    'patch', '{}/'.format(self.api.dcim.devices.url), chunk)
+            except pynetbox.RequestError as e:
+                if e.req.status_code != 405:
+                    raise
+                for update in chunk:
+                    data = dict(update)
+                    self.patch_node(data.pop('id'), data)
+
+    def create(self, endpoint, data):
+        return self.load_record(endpoint, self.request(
+            'post', '{}/'.format(endpoint.url), data))
 
     def create_interface(self, data):
-        return self.api.dcim.interfaces.create(**data).id
+        iface = self.create(self.api.dcim.interfaces, data)
+        self.update_mirror('interfaces', [iface])
+        return iface.id
 
     def create_ip_address(self, data):
-        return self.api.ipam.ip_addresses.create(**data).id
+        address = self.create(self.api.ipam.ip_addresses, data)
+        self._ip_addresses.add(get_address_host(address.address))
+        self.update_mirror('ip-addresses', [address])
+        return address.id
 
     def create_cable(self, data):
-        return self.api.dcim.cables.create(**data).id
+        cable = self.create(self.api.dcim.cables, data)
+        self.update_mirror('cables', [cable])
+        if self._cables is not None:
+            self._index_cable(cable)
+        return cable.id
+
+    def create_objects(self, endpoint, objects):
+        """Create objects with list-form POST requests, in order"""
+        records = []
+        for chunk in chunks(objects, config.netbox_bulk_size):
+            records.extend(
+                self.load_record(endpoint, values)
+                for values in self.request(
+                    'post', '{}/'.format(endpoint.url), chunk))
+        return records
+
+    def create_interfaces(self, objects):
+        interfaces = self.create_objects(self.api.dcim.interfaces, objects)
+        self.update_mirror('interfaces', interfaces)
+        return [iface.id for iface in interfaces]
+
+    def create_ip_addresses(self, objects):
+        addresses = self.create_objects(self.api.ipam.ip_addresses, objects)
+        for address in addresses:
+            self._ip_addresses.add(get_address_host(address.address))
+        self.update_mirror('ip-addresses', addresses)
+        return [address.id for address in addresses]
+
+    def create_cables(self, objects):
+        cables = self.create_objects(self.api.dcim.cables, objects)
+        self.update_mirror('cables', cables)
+        if self._cables is not None:
+            for cable in cables:
+                self._index_cable(cable)
+        return [cable.id for cable in cables]
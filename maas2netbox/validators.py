@@ -16,29 +16,32 @@
 import logging
 from urllib.parse import urlparse
 
-from maas.client.enum import NodeStatus
-
 from maas2netbox import config
-from maas2netbox.utils import maas, netbox
+from maas2netbox.snapshot import Snapshot
 
 
 class Validator(object):
+    needs_hardware = False
 
-    def __init__(self, use_maas=False):
-        self.netbox_api = netbox.NetBoxAPI()
-        self.netbox_nodes = self.sanitized_netbox_nodes()
+    def __init__(self, use_maas=False, snapshot=None):
+        self.snapshot = snapshot or Snapshot(retain=False)
+        self.netbox_api = self.snapshot.netbox_api
         if use_maas:
             self.maas_nodes = self.sanitized_maas_nodes()
         else:
             self.maas_nodes = None
 
+    @property
+    def netbox_nodes(self):
+        """NetBox devices, streamed while they are being checked"""
+        return self.sanitized_netbox_nodes()
+
     def sanitized_netbox_nodes(self):
-        return self.netbox_api.get_nodes()
+        return self.snapshot.iter_netbox_nodes()
 
     def sanitized_maas_nodes(self):
-        nodes = maas.get_nodes()
-        return [node for node in nodes if node.status in [
-            NodeStatus.DEPLOYED, NodeStatus.READY]]
+        nodes = self.snapshot.load_maas_nodes(hardware=self.needs_hardware)
+        return [node for node in nodes if node.sanitized]
 
     def check_nodes(self):
         raise NotImplementedError()
@@ -52,14 +55,15 @@ class Validator(object):
 
 
 class SerialNumberValidator(Validator):
+    needs_hardware = True
 
     def sanitized_maas_nodes(self):
         sanitized_nodes = super(
             SerialNumberValidator, self).sanitized_maas_nodes()
         node_dict = {}
         for node in sanitized_nodes:
-            serial = maas.get_node_serial(node)
-            node_dict[node.hostname] = serial
+            if node.hardware:
+                node_dict[node.hostname] = node.hardware.serial
 
         return node_dict
 
@@ -76,7 +80,8 @@ class SerialNumberValidator(Validator):
                         .format(node.name, node.serial, maas_serial))
                     nodes_with_errors[node.id] = {
                         'current': node.serial,
-                        'expected': maas_serial}
+                        'expected': maas_serial,
+                        'fingerprint': node.fingerprint()}
             except KeyError:
                 continue
 
@@ -87,7 +92,7 @@ class StatusValidator(Validator):
 
     def sanitized_maas_nodes(self):
         node_dict = {}
-        for node in maas.get_nodes():
+        for node in self.snapshot.maas_nodes:
             node_dict[node.hostname.upper()] = node.status
 
         return node_dict
@@ -98,7 +103,7 @@ class StatusValidator(Validator):
 
         for node in self.netbox_nodes:
             try:
-                netbox_status = node.status.label
+                netbox_status = node.status
                 node_status = self.maas_nodes[node.name]
                 translated_status = config.STATUS_DICT[node_status]
 
@@ -109,7 +114,8 @@ class StatusValidator(Validator):
                                 translated_status))
                     nodes_with_errors[node.id] = {
                         'current': netbox_status,
-                        'expected': translated_status}
+                        'expected': translated_status,
+                        'fingerprint': node.fingerprint()}
             except KeyError:
                 continue
 
@@ -123,13 +129,8 @@ class PrimaryIPv4Validator(Validator):
             PrimaryIPv4Validator, self).sanitized_maas_nodes()
         node_dict = {}
         for node in sanitized_nodes:
-            try:
-                bond = node.interfaces.get_by_name('bond0')
-                address = bond.links[0].ip_address
-                if address:
-                    node_dict[node.hostname.upper()] = address
-            except (KeyError, IndexError, AttributeError):
-                continue
+            if node.primary_ipv4:
+                node_dict[node.hostname.upper()] = node.primary_ipv4
 
         return node_dict
 
@@ -140,7 +141,7 @@ class PrimaryIPv4Validator(Validator):
         for node in self.netbox_nodes:
             try:
                 node_address = None if not node.primary_ip4 \
-                    else node.primary_ip4.address.split('/')[0]
+                    else node.primary_ip4.split('/')[0]
                 if node_address != self.maas_nodes[node.name]:
                     logging.info(
                         'Node: {} Declared Primary IPv4: {} '
@@ -149,57 +150,70 @@ class PrimaryIPv4Validator(Validator):
                                 self.maas_nodes[node.name]))
                     nodes_with_errors[node.id] = {
                         'current': node.primary_ip4,
-                        'expected': self.maas_nodes[node.name]}
+                        'expected': self.maas_nodes[node.name],
+                        'fingerprint': node.fingerprint()}
             except KeyError:
                 continue
 
         return nodes_with_errors
 
 
+def get_ifaces_index(interfaces):
+    """(name, MAC) of NetBox interfaces by device id"""
+    index = {}
+    for iface in interfaces:
+        index.setdefault(iface.device.id, set()).add(
+            (iface.name, iface.mac_address))
+    return index
+
+
 class InterfacesValidator(Validator):
+    needs_hardware = True
 
     def sanitized_maas_nodes(self):
         sanitized_nodes = super(
             InterfacesValidator, self).sanitized_maas_nodes()
         node_dict = {}
         for node in sanitized_nodes:
-            ifaces = maas.get_node_interfaces(node)
-            node_dict[node.hostname.upper()] = ifaces
+            if node.hardware:
+                node_dict[node.hostname.upper()] = node.hardware.interfaces
 
         return node_dict
 
+    def get_netbox_ifaces_index(self, nodes):
+        node_ids = [node.id for node in nodes if node.name in self.maas_nodes]
+        return get_ifaces_index(
+            self.netbox_api.get_nodes_interfaces(node_ids))
+
     def check_nodes(self):
         logging.info('Get actual interfaces of node to be declared in NetBox')
         nodes_with_errors = {}
 
-        for node in self.netbox_nodes:
-            missing_ifaces = []
-            try:
-                netbox_node_ifaces = self.netbox_api.get_node_interfaces(
-                    node.id)
-                node_ifaces = self.maas_nodes[node.name]
-                for iface in node_ifaces:
-                    found = False
-                    for netbox_iface in netbox_node_ifaces:
+        for page in self.snapshot.iter_netbox_pages():
+            netbox_ifaces = self.get_netbox_ifaces_index(page)
+            for node in page:
+                missing_ifaces = []
+                try:
+                    node_ifaces = self.maas_nodes[node.name]
+                    for iface in node_ifaces:
                         if (
-                            iface['name'] == netbox_iface.name
-                            and iface['mac_address']
-                                == netbox_iface.mac_address):
-                            found = True
-                            break
-                    if not found:
-                        logging.error(
-                            'Node: {} Missing Interface: {} ({}) ({})'.format(
-                                node.name, iface['name'],
-                                iface['mac_address'], iface['type']))
-                        missing_ifaces.append(iface)
-            except KeyError:
-                pass
-            if missing_ifaces:
-                nodes_with_errors[node.id] = {
-                    'current': [],
-                    'expected': missing_ifaces
-                }
+                            (iface['name'], iface['mac_address'])
+                                not in netbox_ifaces.get(node.id, ())
+                        ):
+                            logging.error(
+                                'Node: {} Missing Interface: {} ({}) ({})'
+                                .format(node.name, iface['name'],
+                                        iface['mac_address'], iface['type']))
+                            missing_ifaces.append(iface)
+                except KeyError:
+                    pass
+                if missing_ifaces:
+                    nodes_with_errors[node.id] = {
+                        'current': [],
+                        'expected': missing_ifaces,
+                        'fingerprint': node.interfaces_fingerprint(
+                            netbox_ifaces.get(node.id, ()))
+                    }
 
         return nodes_with_errors
 
@@ -211,12 +225,7 @@ class PlatformValidator(Validator):
             PlatformValidator, self).sanitized_maas_nodes()
         node_dict = {}
         for node in sanitized_nodes:
-            if node.osystem and node.distro_series:
-                platform = '{}-{}'.format(
-                    node.osystem, node.distro_series)
-            else:
-                platform = None
-            node_dict[node.hostname.upper()] = platform
+            node_dict[node.hostname.upper()] = node.platform
 
         return node_dict
 
@@ -227,8 +236,6 @@ class PlatformValidator(Validator):
         for node in self.netbox_nodes:
             try:
                 declared_platform = node.platform
-                if declared_platform:
-                    declared_platform = declared_platform.slug
                 if declared_platform != self.maas_nodes[node.name]:
                     logging.info(
                         'Node: {} Declared Platform: {} Expected Platform: {}'
@@ -236,7 +243,8 @@ class PlatformValidator(Validator):
                                 self.maas_nodes[node.name]))
                     nodes_with_errors[node.id] = {
                         'current': declared_platform,
-                        'expected': self.maas_nodes[node.name]
+                        'expected': self.maas_nodes[node.name],
+                        'fingerprint': node.fingerprint()
                     }
             except KeyError:
                 continue
@@ -245,27 +253,32 @@ class PlatformValidator(Validator):
 
 
 class SwitchConnectionsValidator(Validator):
+    needs_hardware = True
 
     def sanitized_maas_nodes(self):
         sanitized_nodes = super(
             SwitchConnectionsValidator, self).sanitized_maas_nodes()
         node_dict = {}
         for node in sanitized_nodes:
-            node_dict[node.hostname.upper()] = node
+            if node.hardware:
+                node_dict[node.hostname.upper()] = \
+                    node.hardware.switch_connections
 
         return node_dict
 
     def check_nodes(self):
         logging.info('Check Switch Connections declared at NetBox')
+        self.netbox_api.load_switch_ports(
+            iface['switch_name'] for ifaces in self.maas_nodes.values()
+            for iface in ifaces)
         for node in self.netbox_nodes:
             try:
-                maas_node = self.maas_nodes[node.name]
+                ifaces_details = self.maas_nodes[node.name]
             except KeyError:
                 continue
 
             logging.info('Node: {}'.format(node.name))
 
-            ifaces_details = maas.get_switch_connection_details(maas_node)
             for iface in ifaces_details:
 
                 netbox_ifaces = self.netbox_api.get_node_interfaces(
@@ -294,18 +307,16 @@ class SwitchConnectionsValidator(Validator):
                             logging.error('Node LAG Untagged Vlan Mismatch')
                             continue
 
-                switch = self.netbox_api.get_node_by_name(iface['switch_name'])
+                switch = self.netbox_api.get_switch(iface['switch_name'])
                 if not switch:
                     logging.error('Switch Device is missing')
                     continue
 
-                switch_ports = self.netbox_api.get_node_interfaces(
-                    switch.id, iface['switch_port'])
-                if len(switch_ports) != 1:
+                switch_port = self.netbox_api.get_switch_port(
+                    iface['switch_name'], iface['switch_port'])
+                if not switch_port:
                     logging.error('Switch port problem')
                     continue
-                else:
-                    switch_port = switch_ports[0]
 
                 cable = self.netbox_api.get_cable(
                     netbox_iface.id, switch_port.id)